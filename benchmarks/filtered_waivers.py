@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Compares plan time and latency of the filter clauses used by
+POST /api/v1.0/waivers/+filtered on a PostgreSQL database.
+
+The OR-chain clause (one AND clause per filter) is compared with the single
+tuple IN clause used for homogeneous filter lists.
+
+Usage::
+
+    WAIVERDB_BENCHMARK_DB=postgresql+psycopg2:///waiverdb_bench \\
+        PYTHONPATH=. python benchmarks/filtered_waivers.py
+
+Beware that the benchmark drops and re-creates all tables in the database.
+"""
+
+import os
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.expression import and_, or_, select, tuple_
+
+from waiverdb.models import db, Waiver
+
+FILTER_COUNTS = (10, 100, 1000, 10000)
+WAIVER_COUNT = 100000
+REPEAT = 5
+
+
+def populate(connection):
+    db.metadata.drop_all(connection)
+    db.metadata.create_all(connection)
+    connection.execute(text("""
+        INSERT INTO waiver (subject_type, subject_identifier, testcase, username,
+                            product_version, waived, comment, timestamp)
+        SELECT 'koji_build', 'pkg-1.0-' || i || '.fc38', 'case.' || (i % 50),
+               'user', 'fedora-38', true, 'benchmark', now()
+        FROM generate_series(1, :count) AS i
+    """), {'count': WAIVER_COUNT})
+    connection.execute(text('ANALYZE waiver'))
+
+
+def or_clause(filters):
+    return or_(*(
+        and_(
+            Waiver.subject_type == subject_type,
+            Waiver.subject_identifier == subject_identifier,
+            Waiver.testcase == testcase,
+        )
+        for subject_type, subject_identifier, testcase in filters
+    ))
+
+
+def in_clause(filters):
+    columns = tuple_(Waiver.subject_type, Waiver.subject_identifier, Waiver.testcase)
+    return columns.in_(filters)
+
+
+def explain(connection, clause):
+    query = select(Waiver.__table__).where(clause).order_by(Waiver.timestamp.desc())
+    sql = str(query.compile(
+        dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+    plan_times = []
+    latencies = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = connection.execute(text('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql)).scalar()
+        latencies.append(time.perf_counter() - start)
+        plan_times.append(result[0]['Planning Time'])
+    return min(plan_times), min(latencies) * 1000
+
+
+def main():
+    engine = create_engine(os.environ['WAIVERDB_BENCHMARK_DB'])
+    with engine.begin() as connection:
+        populate(connection)
+        print('%8s %12s %12s %12s %12s' % (
+            'filters', 'or plan ms', 'or total ms', 'in plan ms', 'in total ms'))
+        for count in FILTER_COUNTS:
+            filters = [
+                ('koji_build', 'pkg-1.0-%d.fc38' % i, 'case.%d' % (i % 50))
+                for i in range(1, count + 1)
+            ]
+            or_plan, or_total = explain(connection, or_clause(filters))
+            in_plan, in_total = explain(connection, in_clause(filters))
+            print('%8d %12.2f %12.2f %12.2f %12.2f' % (
+                count, or_plan, or_total, in_plan, in_total))
+
+
+if __name__ == '__main__':
+    main()
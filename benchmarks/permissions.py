@@ -0,0 +1,75 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Compares the number of test cases per second matched against PERMISSIONS by
+iterating over the permissions (``match_testcase_permissions()`` with a list)
+and by ``waiverdb.authorization.PermissionMatcher``, for configurations with
+10, 100 and 1000 rules.
+
+The matcher is measured both with the result cache disabled and enabled.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/permissions.py
+"""
+
+import timeit
+
+from waiverdb.authorization import PermissionMatcher, match_testcase_permissions
+
+RULE_COUNTS = (10, 100, 1000)
+TESTCASE_COUNT = 1000
+REPEAT = 5
+
+
+def make_permissions(count):
+    permissions = []
+    for i in range(count):
+        if i % 10 == 0:
+            permissions.append({
+                'name': 'legacy-%d' % i,
+                '_testcase_regex_pattern': '^legacy-%d\\.' % i,
+                'groups': ['group-%d' % i],
+            })
+        else:
+            permissions.append({
+                'name': 'team-%d' % i,
+                'testcases': ['team-%d.*' % i, 'shared.team-%d.tier[12].*' % i],
+                'groups': ['group-%d' % i],
+            })
+    permissions.append({'name': 'admins', 'testcases': ['*'], 'groups': ['admins']})
+    return permissions
+
+
+def make_testcases(count):
+    return [
+        ('team-%d.test-%d' if i % 2 else 'shared.team-%d.tier1.test-%d') % (i % count, i)
+        for i in range(TESTCASE_COUNT)
+    ]
+
+
+def main():
+    for count in RULE_COUNTS:
+        permissions = make_permissions(count)
+        testcases = make_testcases(count)
+        uncached = PermissionMatcher(permissions, cache_size=0)
+        cached = PermissionMatcher(permissions)
+        for testcase in testcases:
+            assert list(uncached.match(testcase)) \
+                == list(match_testcase_permissions(testcase, permissions))
+
+        candidates = [
+            ('list', lambda: [
+                list(match_testcase_permissions(t, permissions)) for t in testcases]),
+            ('PermissionMatcher (no cache)', lambda: [
+                list(uncached.match(t)) for t in testcases]),
+            ('PermissionMatcher', lambda: [
+                list(cached.match(t)) for t in testcases]),
+        ]
+        print('%d rules:' % count)
+        for name, func in candidates:
+            seconds = min(timeit.repeat(func, number=1, repeat=REPEAT))
+            print('  %-30s %12.0f test cases/s' % (name, TESTCASE_COUNT / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Compares the number of waivers per second serialized by flask_restful
+``marshal()`` with ``waiverdb.fields.serialize_waiver()``.
+
+Usage::
+
+    PYTHONPATH=. python benchmarks/serializer.py
+"""
+
+import datetime
+import json
+import timeit
+
+from flask_restful import marshal
+
+from waiverdb.fields import serialize_waiver, waiver_fields
+from waiverdb.models import Waiver
+from waiverdb.utils import json_dumps
+
+ROW_COUNT = 10000
+REPEAT = 5
+
+
+def make_waivers():
+    waivers = []
+    for i in range(ROW_COUNT):
+        waiver = Waiver(
+            'koji_build', 'pkg-1.0-%d.fc38' % i, 'case.%d' % (i % 50), 'user', 'fedora-38',
+            waived=True, comment='benchmark')
+        waiver.id = i
+        waiver.timestamp = datetime.datetime.utcnow()
+        waivers.append(waiver)
+    return waivers
+
+
+def main():
+    waivers = make_waivers()
+    candidates = [
+        ('marshal + json.dumps',
+         lambda: json.dumps(marshal(waivers, waiver_fields))),
+        ('serialize_waiver + json.dumps',
+         lambda: json.dumps([serialize_waiver(w) for w in waivers])),
+        ('serialize_waiver + json_dumps',
+         lambda: json_dumps([serialize_waiver(w) for w in waivers])),
+    ]
+    for name, func in candidates:
+        seconds = min(timeit.repeat(func, number=1, repeat=REPEAT))
+        print('%-32s %12.0f rows/s' % (name, ROW_COUNT / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 # SPDX-License-Identifier: GPL-2.0+
 
 import json
+import time
 from base64 import b64encode
 
 import mock
@@ -8,7 +9,13 @@ import ldap
 import pytest
 from click.testing import CliRunner
 from textwrap import dedent
-from werkzeug.exceptions import Unauthorized
+from werkzeug.exceptions import BadGateway, Unauthorized
+from waiverdb.authorization import (
+    AuthorizationContext,
+    LdapConnectionPool,
+    verify_authorization,
+)
+from waiverdb.cache import LocalCache
 from waiverdb.cli import cli as waiverdb_cli
 
 
@@ -32,6 +39,8 @@ def enable_permissions(app, monkeypatch):
         },
     ]
     monkeypatch.setitem(app.config, 'PERMISSIONS', permissions)
+    # Do not reuse LDAP connections mocked in other tests.
+    monkeypatch.setattr(app, 'ldap_connection_pools', {})
 
 
 @pytest.mark.usefixtures('enable_permissions')
@@ -234,3 +243,147 @@ class TestAccessControl(object):
             result = runner.invoke(waiverdb_cli, args)
             mock_request.assert_called_once()
             assert result.output.startswith('Created waiver 15 for result with id 123\n')
+
+
+PERMISSIONS = [{"testcases": ["testcase1.*"], "groups": ["factory-2-0"], "users": []}]
+LDAP_SEARCHES = [
+    {'BASE': 'ou=Groups,dc=example,dc=com'},
+    {'BASE': 'ou=Users,dc=example,dc=com', 'SEARCH_STRING': '(uid={user})'},
+]
+
+
+@mock.patch('ldap.initialize')
+@mock.patch('waiverdb.authorization.get_group_membership',
+            side_effect=[[], ['factory-2-0']])
+def test_group_membership_is_cached(mocked_membership, mocked_initialize):
+    cache = LocalCache(max_size=10, ttl=60)
+    for _ in range(5):
+        assert verify_authorization('foo', 'testcase1.functional', PERMISSIONS,
+                                    'ldap://ldap.example.com', LDAP_SEARCHES,
+                                    membership_cache=cache, negative_cache_ttl=60)
+    assert mocked_membership.call_count == 2
+    mocked_initialize.assert_called_once()
+
+
+@mock.patch('ldap.initialize')
+@mock.patch('waiverdb.authorization.get_group_membership', return_value=[])
+def test_empty_group_membership_expires(mocked_membership, mocked_initialize):
+    cache = LocalCache(max_size=10, ttl=60)
+    for _ in range(2):
+        with pytest.raises(Unauthorized):
+            verify_authorization('foo', 'testcase1.functional', PERMISSIONS,
+                                 'ldap://ldap.example.com', LDAP_SEARCHES[:1],
+                                 membership_cache=cache, negative_cache_ttl=0)
+    assert mocked_membership.call_count == 2
+
+
+@mock.patch('ldap.initialize')
+@mock.patch('waiverdb.authorization.get_group_membership', return_value=['factory-2-0'])
+def test_group_membership_without_cache(mocked_membership, mocked_initialize):
+    for _ in range(2):
+        assert verify_authorization('foo', 'testcase1.functional', PERMISSIONS,
+                                    'ldap://ldap.example.com', LDAP_SEARCHES)
+    assert mocked_membership.call_count == 2
+
+
+@mock.patch('ldap.initialize')
+def test_ldap_connection_pool_reuses_connections(mocked_initialize):
+    pool = LdapConnectionPool('ldap://ldap.example.com', network_timeout=2, timeout=3)
+    with pool.connection(ldap) as con1:
+        pass
+    with pool.connection(ldap) as con2:
+        pass
+    assert con1 is con2
+    mocked_initialize.assert_called_once_with('ldap://ldap.example.com')
+    con1.set_option.assert_has_calls([
+        mock.call(ldap.OPT_NETWORK_TIMEOUT, 2),
+        mock.call(ldap.OPT_TIMEOUT, 3),
+    ])
+
+
+@mock.patch('ldap.initialize')
+def test_ldap_connection_pool_checks_idle_connections(mocked_initialize):
+    broken = mock.Mock()
+    broken.whoami_s.side_effect = ldap.SERVER_DOWN()
+    mocked_initialize.side_effect = [broken, mock.Mock()]
+    pool = LdapConnectionPool('ldap://ldap.example.com', idle_check=0)
+    with pool.connection(ldap):
+        pass
+    with pool.connection(ldap) as con:
+        assert con is not broken
+    broken.unbind_s.assert_called_once()
+
+
+@mock.patch('ldap.initialize')
+def test_ldap_connection_pool_circuit_breaker(mocked_initialize):
+    pool = LdapConnectionPool('ldap://ldap.example.com', failure_threshold=2, retry_delay=30)
+    for _ in range(2):
+        with pytest.raises(BadGateway):
+            with pool.connection(ldap):
+                raise BadGateway('The LDAP server is not reachable.')
+    assert mocked_initialize.call_count == 2
+
+    with pytest.raises(BadGateway):
+        with pool.connection(ldap):
+            pass
+    assert mocked_initialize.call_count == 2
+
+    with mock.patch('waiverdb.authorization.time.monotonic',
+                    return_value=time.monotonic() + 31):
+        with pool.connection(ldap):
+            pass
+    assert mocked_initialize.call_count == 3
+
+
+@mock.patch('ldap.initialize')
+def test_verify_authorization_with_connection_pool(mocked_initialize):
+    mocked_initialize.return_value.search_s.return_value = [
+        ('cn=factory-2-0,ou=Groups,dc=example,dc=com', {'cn': [b'factory-2-0']}),
+    ]
+    pool = LdapConnectionPool('ldap://ldap.example.com')
+    for _ in range(2):
+        assert verify_authorization('foo', 'testcase1.functional', PERMISSIONS,
+                                    'ldap://ldap.example.com', LDAP_SEARCHES,
+                                    connection_pool=pool)
+    mocked_initialize.assert_called_once()
+
+
+@mock.patch('ldap.initialize')
+@mock.patch('waiverdb.authorization.get_group_membership',
+            side_effect=[['devel'], ['factory-2-0', 'qa']])
+def test_authorization_context_fetches_groups_once(mocked_membership, mocked_initialize):
+    permissions = PERMISSIONS + [{"testcases": ["testcase2.*"], "groups": ["qa"]}]
+    context = AuthorizationContext(permissions, 'ldap://ldap.example.com', LDAP_SEARCHES)
+    for testcase in ['testcase1.functional', 'testcase2.functional'] * 5:
+        assert context.verify('foo', testcase)
+    assert mocked_membership.call_count == 2
+
+    with pytest.raises(Unauthorized):
+        context.verify('foo', 'testcase3')
+    assert mocked_membership.call_count == 2
+
+
+@pytest.mark.usefixtures('enable_permissions')
+@mock.patch('waiverdb.auth.get_user', return_value=('bar', {}))
+@mock.patch('waiverdb.authorization.get_group_membership', return_value=['factory-2-0'])
+def test_create_multiple_waivers_authorized_once(
+        mocked_membership, mocked_get_user, app, client, session, monkeypatch):
+    monkeypatch.setitem(app.config, 'LDAP_HOST', 'ldap://ldap.example.com')
+    monkeypatch.setitem(app.config, 'LDAP_BASE', 'ou=Groups,dc=example,dc=com')
+    data = [
+        {
+            'subject_type': 'koji_build',
+            'subject_identifier': 'glibc-2.26-%d.fc27' % i,
+            'testcase': 'testcase1.functional',
+            'product_version': 'fool-1',
+            'waived': True,
+            'comment': 'it broke',
+        }
+        for i in range(10)
+    ]
+    with mock.patch('ldap.initialize'):
+        r = client.post('/api/v1.0/waivers/', data=json.dumps(data),
+                        content_type='application/json')
+    assert r.status_code == 201, r.text
+    assert len(r.json) == 10
+    mocked_membership.assert_called_once()
@@ -10,7 +10,9 @@ from stomp.exception import StompException
 
 from .utils import create_waiver
 from waiverdb import __version__
+from waiverdb.cache import LocalCache
 from waiverdb.models import Waiver
+import waiverdb.monitor as monitor
 
 
 @pytest.fixture
@@ -357,6 +359,194 @@ def test_pagination_waivers(client, session):
     assert '/waivers/?page=3' in res_data['last']
 
 
+@pytest.mark.parametrize('count', ('estimate', 'none'))
+def test_pagination_waivers_without_exact_count(client, session, count):
+    for i in range(0, 30):
+        create_waiver(session, subject_type='koji_build', subject_identifier="%d" % i,
+                      testcase="case %d" % i, username='foo %d' % i,
+                      product_version='foo-%d' % i, comment='bla bla bla')
+    with patch('waiverdb.utils.estimate_count', return_value=25):
+        r = client.get(f'/api/v1.0/waivers/?page=2&count={count}')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 200
+    assert len(res_data['data']) == 10
+    assert '/waivers/?page=1' in res_data['prev']
+    assert '/waivers/?page=3' in res_data['next']
+    assert '/waivers/?page=1' in res_data['first']
+    if count == 'none':
+        assert res_data['last'] is None
+    else:
+        assert '/waivers/?page=3' in res_data['last']
+
+    r = client.get(f'/api/v1.0/waivers/?page=3&count={count}')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert len(res_data['data']) == 10
+    assert res_data['next'] is None
+
+    r = client.get(f'/api/v1.0/waivers/?page=4&count={count}')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert res_data['data'] == []
+    assert res_data['last'] is None
+
+
+@pytest.mark.parametrize('count', ('exact', 'estimate', 'none'))
+def test_pagination_waivers_with_limit_over_100(client, session, count):
+    for i in range(0, 250):
+        create_waiver(session, subject_type='koji_build', subject_identifier="%d" % i,
+                      testcase="case %d" % i, username='foo %d' % i,
+                      product_version='foo-%d' % i, comment='bla bla bla')
+    with patch('waiverdb.utils.estimate_count', return_value=250):
+        r = client.get(f'/api/v1.0/waivers/?limit=200&count={count}')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 200
+    assert len(res_data['data']) == 200
+    assert 'page=2' in res_data['next']
+    if count == 'none':
+        assert res_data['last'] is None
+    else:
+        assert 'page=2' in res_data['last']
+
+    r = client.get(f'/api/v1.0/waivers/?limit=200&page=2&count={count}')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert len(res_data['data']) == 50
+    assert res_data['next'] is None
+
+
+def test_pagination_waivers_with_invalid_count(client, session):
+    r = client.get('/api/v1.0/waivers/?count=maybe')
+    assert r.status_code == 400
+
+
+def test_cursor_pagination_waivers(client, session):
+    waivers = []
+    for i in range(0, 25):
+        waivers.append(create_waiver(
+            session, subject_type='koji_build', subject_identifier="%d" % i,
+            testcase="case %d" % i, username='foo %d' % i,
+            product_version='foo-%d' % i, comment='bla bla bla'))
+    expected_ids = [w.id for w in sorted(
+        waivers, key=lambda w: (w.timestamp, w.id), reverse=True)]
+
+    r = client.get('/api/v1.0/waivers/?cursor=')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 200
+    assert [w['id'] for w in res_data['data']] == expected_ids[:10]
+    assert res_data['prev'] is None
+    assert res_data['last'] is None
+    assert 'cursor=' in res_data['next']
+
+    r = client.get(res_data['next'])
+    res_data = json.loads(r.get_data(as_text=True))
+    assert [w['id'] for w in res_data['data']] == expected_ids[10:20]
+    page2_prev = res_data['prev']
+
+    r = client.get(res_data['next'])
+    res_data = json.loads(r.get_data(as_text=True))
+    assert [w['id'] for w in res_data['data']] == expected_ids[20:]
+    assert res_data['next'] is None
+
+    r = client.get(page2_prev)
+    res_data = json.loads(r.get_data(as_text=True))
+    assert [w['id'] for w in res_data['data']] == expected_ids[:10]
+    assert res_data['prev'] is None
+
+
+@pytest.mark.parametrize('limit', (0, -1))
+def test_cursor_pagination_with_limit_below_one(client, session, limit):
+    create_waiver(session, subject_type='koji_build', subject_identifier='glibc-2.26-27.fc27',
+                  testcase='testcase1', username='foo', product_version='foo-1')
+    for mode in ('cursor=', 'page=1'):
+        r = client.get(f'/api/v1.0/waivers/?{mode}&limit={limit}')
+        assert r.status_code == 200
+        assert r.json == {'data': [], 'prev': None, 'next': None, 'first': None, 'last': None}
+
+
+def test_cursor_pagination_with_malformed_cursor(client, session):
+    r = client.get('/api/v1.0/waivers/?cursor=bad')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 400
+    assert res_data['message'] == {'cursor': 'Invalid cursor value'}
+
+
+def test_get_waivers_with_fields(client, session):
+    create_waiver(session, subject_type='koji_build',
+                  subject_identifier='glibc-2.26-27.fc27',
+                  testcase='testcase1', username='foo',
+                  product_version='foo-1', scenario='scenario1')
+    r = client.get('/api/v1.0/waivers/?fields=testcase,subject,waived')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 200
+    assert res_data['data'] == [{
+        'subject': {'type': 'koji_build', 'item': 'glibc-2.26-27.fc27'},
+        'testcase': 'testcase1',
+        'waived': True,
+    }]
+
+
+def test_get_waivers_with_unknown_fields(client, session):
+    r = client.get('/api/v1.0/waivers/?fields=testcase,bogus')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 400
+    assert res_data['message'] == {'fields': 'Unknown fields: bogus'}
+
+
+def test_get_waivers_conditional(client, session):
+    create_waiver(session, subject_type='koji_build', subject_identifier='glibc-2.26-27.fc27',
+                  testcase='testcase1', username='foo', product_version='foo-1')
+    r = client.get('/api/v1.0/waivers/')
+    assert r.status_code == 200
+    etag = r.headers['ETag']
+    assert 'Last-Modified' not in r.headers
+
+    r = client.get('/api/v1.0/waivers/', headers={'If-None-Match': etag})
+    assert r.status_code == 304
+    assert r.get_data() == b''
+
+    # Different query has different ETag
+    r = client.get('/api/v1.0/waivers/?limit=5', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+
+    create_waiver(session, subject_type='koji_build', subject_identifier='glibc-2.26-27.fc27',
+                  testcase='testcase2', username='foo', product_version='foo-1')
+    r = client.get('/api/v1.0/waivers/', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert r.headers['ETag'] != etag
+    assert len(r.json['data']) == 2
+
+
+def test_get_waivers_conditional_lower_id_committed_later(client, session):
+    """
+    A transaction can commit a waiver with a lower id after a waiver with a
+    higher id was committed.
+    """
+    waiver = Waiver('koji_build', 'glibc-2.26-27.fc27', 'testcase1', 'foo', 'foo-1')
+    waiver.id = 10
+    session.add(waiver)
+    session.flush()
+    r = client.get('/api/v1.0/waivers/')
+    assert r.status_code == 200
+    etag = r.headers['ETag']
+
+    waiver = Waiver('koji_build', 'glibc-2.26-27.fc27', 'testcase2', 'foo', 'foo-1')
+    waiver.id = 5
+    session.add(waiver)
+    session.flush()
+    r = client.get('/api/v1.0/waivers/', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+    assert len(r.json['data']) == 2
+
+
+def test_get_waiver_conditional(client, session):
+    waiver = create_waiver(session, subject_type='koji_build',
+                           subject_identifier='glibc-2.26-27.fc27',
+                           testcase='testcase1', username='foo', product_version='foo-1')
+    r = client.get('/api/v1.0/waivers/%s' % waiver.id)
+    assert r.status_code == 200
+    r = client.get('/api/v1.0/waivers/%s' % waiver.id,
+                   headers={'If-None-Match': r.headers['ETag']})
+    assert r.status_code == 304
+
+
 def test_obsolete_waivers_are_excluded_by_default(client, session):
     create_waiver(session, subject_type='koji_build',
                   subject_identifier='glibc-2.26-27.fc27',
@@ -464,6 +654,41 @@ def test_filtering_waivers_by_testcase(client, session):
     assert res_data['data'][0]['testcase'] == 'testcase1'
 
 
+@pytest.mark.parametrize('query', (
+    'testcase=testcase1&testcase=testcase3',
+    'testcase=testcase1,testcase3',
+    'testcase=testcase1&testcase=testcase3,testcase1',
+))
+def test_filtering_waivers_by_multiple_testcases(client, session, query):
+    for i in range(1, 4):
+        create_waiver(session, subject_type='koji_build', subject_identifier='glibc-2.26-27.fc27',
+                      testcase='testcase%d' % i, username='foo-1', product_version='foo-1')
+
+    r = client.get('/api/v1.0/waivers/?' + query)
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 200
+    assert sorted(w['testcase'] for w in res_data['data']) == ['testcase1', 'testcase3']
+
+
+def test_filtering_waivers_by_multiple_values_keeps_them_in_links(client, session):
+    for i in range(1, 4):
+        create_waiver(session, subject_type='koji_build', subject_identifier='glibc-2.26-27.fc27',
+                      testcase='testcase%d' % i, username='foo-1', product_version='foo-1')
+
+    r = client.get('/api/v1.0/waivers/?testcase=testcase1&testcase=testcase2&limit=1')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 200
+    assert 'testcase=testcase1&testcase=testcase2' in res_data['next']
+
+
+def test_filtering_waivers_with_too_many_values(client, session):
+    testcases = ','.join('testcase%d' % i for i in range(101))
+    r = client.get('/api/v1.0/waivers/?testcase=' + testcases)
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 400
+    assert res_data['message']['testcase'] == 'Too many values, at most 100 are allowed'
+
+
 def test_filtering_waivers_by_product_version(client, session):
     create_waiver(session, subject_type='koji_build', subject_identifier='glibc-2.26-27.fc27',
                   testcase='testcase1', username='foo-1', product_version='release-1')
@@ -593,6 +818,196 @@ def test_filtering_waivers_with_post(client, session):
     assert all(w['subject_identifier'].startswith('python2-2.7.14') for w in res_data['data'])
 
 
+def test_filtering_waivers_with_post_mixed_filters(client, session):
+    create_waiver(session, subject_type='koji_build',
+                  subject_identifier='python2-2.7.14-1.fc27',
+                  testcase='case 1', username='person',
+                  product_version='fedora-27', comment='bla bla bla')
+    create_waiver(session, subject_type='koji_build',
+                  subject_identifier='python2-2.7.14-2.fc27',
+                  testcase='case 2', username='person',
+                  product_version='fedora-27', comment='bla bla bla')
+    create_waiver(session, subject_type='koji_build',
+                  subject_identifier='glibc-2.26-27.fc27',
+                  testcase='case 2', username='person',
+                  product_version='fedora-28', comment='bla bla bla')
+    filters = [
+        {'subject_identifier': 'python2-2.7.14-1.fc27', 'testcase': 'case 1'},
+        {'product_version': 'fedora-28'},
+    ]
+    r = client.post('/api/v1.0/waivers/+filtered',
+                    data=json.dumps({'filters': filters}),
+                    content_type='application/json')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 200
+    assert sorted(w['subject_identifier'] for w in res_data['data']) == [
+        'glibc-2.26-27.fc27', 'python2-2.7.14-1.fc27']
+
+    filters = [{'testcase': 'case 1'}, {'testcase': 'case 2'}]
+    r = client.post('/api/v1.0/waivers/+filtered',
+                    data=json.dumps({'filters': filters}),
+                    content_type='application/json')
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 200
+    assert len(res_data['data']) == 3
+
+
+def test_filtering_waivers_with_post_stream(client, session):
+    filters = []
+    for i in range(1, 11):
+        filters.append({'subject_type': 'koji_build',
+                        'subject_identifier': 'python2-2.7.14-%d.fc27' % i,
+                        'testcase': 'case %d' % i})
+        create_waiver(session, subject_type='koji_build',
+                      subject_identifier='python2-2.7.14-%d.fc27' % i,
+                      testcase='case %d' % i, username='person',
+                      product_version='fedora-27', comment='bla bla bla')
+    data = {'filters': filters}
+    r = client.post('/api/v1.0/waivers/+filtered', json=data)
+    expected = json.loads(r.get_data(as_text=True))
+
+    data['stream'] = True
+    r = client.post('/api/v1.0/waivers/+filtered', json=data)
+    assert r.status_code == 200
+    assert r.is_streamed
+    assert r.content_type == 'application/json'
+    assert json.loads(r.get_data(as_text=True)) == expected
+    assert len(expected['data']) == 10
+
+
+def test_filtering_waivers_with_post_fields(client, session):
+    create_waiver(session, subject_type='koji_build',
+                  subject_identifier='python2-2.7.14-1.fc27',
+                  testcase='case 1', username='person',
+                  product_version='fedora-27', scenario='scenario1')
+    data = {
+        'filters': [{'testcase': 'case 1'}],
+        'fields': ['subject_type', 'subject_identifier', 'testcase', 'scenario', 'waived'],
+    }
+    r = client.post('/api/v1.0/waivers/+filtered', json=data)
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 200
+    assert res_data['data'] == [{
+        'subject_type': 'koji_build',
+        'subject_identifier': 'python2-2.7.14-1.fc27',
+        'testcase': 'case 1',
+        'scenario': 'scenario1',
+        'waived': True,
+    }]
+
+
+@pytest.fixture
+def filtered_waivers_cache(app):
+    cache = LocalCache(max_size=10, ttl=60)
+    with patch.object(app, 'filtered_waivers_cache', cache, create=True):
+        yield cache
+
+
+def test_filtering_waivers_with_post_cached(client, session, filtered_waivers_cache):
+    create_waiver(session, subject_type='koji_build',
+                  subject_identifier='python2-2.7.14-1.fc27',
+                  testcase='case 1', username='person',
+                  product_version='fedora-27')
+    data = {'filters': [{'testcase': 'case 1'}]}
+    r = client.post('/api/v1.0/waivers/+filtered', json=data)
+    assert r.status_code == 200
+    expected = json.loads(r.get_data(as_text=True))
+    assert len(expected['data']) == 1
+
+    with patch('waiverdb.api_v1._waivers_query') as mocked_query:
+        r = client.post('/api/v1.0/waivers/+filtered', json=data)
+    mocked_query.assert_not_called()
+    assert r.status_code == 200
+    assert json.loads(r.get_data(as_text=True)) == expected
+
+
+def test_filtering_waivers_with_post_cache_invalidated(
+        client, session, filtered_waivers_cache):
+    create_waiver(session, subject_type='koji_build',
+                  subject_identifier='python2-2.7.14-1.fc27',
+                  testcase='case 1', username='person',
+                  product_version='fedora-27')
+    data = {'filters': [{'testcase': 'case 1'}]}
+    r = client.post('/api/v1.0/waivers/+filtered', json=data)
+    assert len(json.loads(r.get_data(as_text=True))['data']) == 1
+    version = filtered_waivers_cache.version()
+
+    create_waiver(session, subject_type='koji_build',
+                  subject_identifier='python2-2.7.14-2.fc27',
+                  testcase='case 1', username='person',
+                  product_version='fedora-27')
+    session.commit()
+    assert filtered_waivers_cache.version() == version + 1
+    r = client.post('/api/v1.0/waivers/+filtered', json=data)
+    assert len(json.loads(r.get_data(as_text=True))['data']) == 2
+
+
+def test_filtering_waivers_with_post_redis_unavailable(client, session, app):
+    redis = pytest.importorskip('redis')
+    from waiverdb.cache import RedisCache
+
+    mocked_redis = Mock()
+    error = redis.exceptions.ConnectionError('Connection refused')
+    mocked_redis.get.side_effect = error
+    mocked_redis.set.side_effect = error
+    mocked_redis.incr.side_effect = error
+    with patch('redis.Redis.from_url', return_value=mocked_redis):
+        cache = RedisCache('redis://localhost:6379/0', ttl=60)
+    assert cache.version() is None
+
+    with patch.object(app, 'filtered_waivers_cache', cache, create=True):
+        create_waiver(session, subject_type='koji_build',
+                      subject_identifier='python2-2.7.14-1.fc27',
+                      testcase='case 1', username='person',
+                      product_version='fedora-27')
+        # Invalidating the cache after commit does not fail.
+        session.commit()
+        mocked_redis.incr.assert_called_once()
+
+        counter = monitor.filtered_waivers_cache_counter
+        errors = counter.labels(result='error')._value.get()
+        misses = counter.labels(result='miss')._value.get()
+        r = client.post('/api/v1.0/waivers/+filtered', json={'filters': [{'testcase': 'case 1'}]})
+    assert r.status_code == 200
+    assert len(json.loads(r.get_data(as_text=True))['data']) == 1
+    assert counter.labels(result='error')._value.get() == errors + 1
+    assert counter.labels(result='miss')._value.get() == misses
+
+    assert cache.get('key') is None
+    cache.set('key', {'data': []})
+    mocked_redis.set.assert_called_once()
+
+
+def test_get_waivers_by_ids(client, session):
+    waivers = [
+        create_waiver(session, subject_type='koji_build',
+                      subject_identifier='python2-2.7.14-%d.fc27' % i,
+                      testcase='case %d' % i, username='person',
+                      product_version='fedora-27')
+        for i in range(3)
+    ]
+    ids = [waivers[2].id, 9999, waivers[0].id]
+    r = client.post('/api/v1.0/waivers/+by-ids', json={'ids': ids, 'fields': ['id', 'testcase']})
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 200
+    assert res_data == {
+        'data': [
+            {'id': waivers[2].id, 'testcase': 'case 2'},
+            None,
+            {'id': waivers[0].id, 'testcase': 'case 0'},
+        ],
+        'missing': [9999],
+    }
+
+
+@pytest.mark.parametrize('ids', ([], ['1'], [True], 1, list(range(101))))
+def test_get_waivers_by_invalid_ids(client, session, ids):
+    r = client.post('/api/v1.0/waivers/+by-ids', json={'ids': ids})
+    res_data = json.loads(r.get_data(as_text=True))
+    assert r.status_code == 400
+    assert 'ids' in res_data['message']
+
+
 def test_filtering_with_missing_filter(client, session):
     r = client.post('/api/v1.0/waivers/+filtered',
                     data=json.dumps({'somethingelse': 'what'}),
@@ -768,6 +1183,22 @@ def test_permissions_endpoint(client):
         assert r.json == config['PERMISSIONS'][0:1]
 
 
+def test_permissions_endpoint_conditional(client, monkeypatch):
+    monkeypatch.setitem(client.application.config, 'PERMISSIONS', [])
+    r = client.get('/api/v1.0/permissions')
+    assert r.status_code == 200
+    etag = r.headers['ETag']
+
+    r = client.get('/api/v1.0/permissions', headers={'If-None-Match': etag})
+    assert r.status_code == 304
+
+    monkeypatch.setitem(client.application.config, 'PERMISSIONS', [
+        {'name': 'all', 'testcases': ['*'], 'users': ['foo']},
+    ])
+    r = client.get('/api/v1.0/permissions', headers={'If-None-Match': etag})
+    assert r.status_code == 200
+
+
 def test_config_endpoint_superusers(client):
     config = {
         'SUPERUSERS': ['alice', 'bob']
@@ -3,7 +3,9 @@
 """This module contains tests for :mod:`waiverdb.app`."""
 from __future__ import unicode_literals
 
+from flask import Flask
 from mock import ANY, call, patch
+from sqlalchemy import create_engine
 
 from waiverdb import app, config
 from flask_sqlalchemy import SignallingSession
@@ -37,3 +39,36 @@ def test_enabled_messaging_should_register_events(mock_listen):
         c for c in mock_listen.mock_calls if c == call(ANY, ANY, app.publish_new_waiver)
     ]
     assert calls == [call(SignallingSession, "after_commit", app.publish_new_waiver)]
+
+
+class PoolConfig(config.Config):
+    DATABASE_POOL_SIZE = 20
+    DATABASE_POOL_PRE_PING = True
+
+
+class NullPoolConfig(config.Config):
+    DATABASE_NULL_POOL = True
+
+
+def test_pool_settings():
+    flask_app = Flask(__name__)
+    flask_app.config.from_object(PoolConfig)
+    app.populate_db_config(flask_app)
+    options = flask_app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert options['poolclass'] is app.InstrumentedQueuePool
+    assert options['pool_size'] == 20
+    assert options['max_overflow'] == 10
+    assert options['pool_pre_ping'] is True
+
+    engine = create_engine(flask_app.config['SQLALCHEMY_DATABASE_URI'], **options)
+    assert isinstance(engine.pool, app.InstrumentedQueuePool)
+    assert engine.pool.size() == 20
+
+
+def test_null_pool_settings():
+    flask_app = Flask(__name__)
+    flask_app.config.from_object(NullPoolConfig)
+    app.populate_db_config(flask_app)
+    options = flask_app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert options['poolclass'] is app.InstrumentedNullPool
+    assert 'pool_size' not in options
@@ -1,5 +1,7 @@
-from waiverdb.api_v1 import permissions
-from waiverdb.authorization import match_testcase_permissions
+import pytest
+
+from waiverdb.api_v1 import permission_matcher, permissions
+from waiverdb.authorization import PermissionMatcher, match_testcase_permissions
 
 
 def test_permissions_mapping_compat(app, monkeypatch):
@@ -67,3 +69,57 @@ def test_match_testcase_permissions():
         == [permissions[1]]
     assert list(match_testcase_permissions("kernel-qe.test1", permissions)) \
         == [permissions[0]]
+
+
+EQUIVALENCE_PERMISSIONS = [
+    {"name": "kernel", "testcases": ["kernel-qe.*", "kernel.tier[12].*"]},
+    {"name": "regex", "_testcase_regex_pattern": "^kernel-qe"},
+    {"name": "no testcases"},
+    {"name": "exact", "testcases": ["greenwave-tests.test1"]},
+    {"name": "regex search", "_testcase_regex_pattern": r"\.test\d$"},
+    {"name": "all", "testcases": ["*"]},
+    {"name": "question mark", "testcases": ["greenwave-tests.test?"]},
+    {"name": "empty", "testcases": []},
+    {"name": "regex group", "_testcase_regex_pattern": r"^(kernel)-qe\.\1"},
+    {"name": "override", "testcases": ["kernel-qe.*"], "_testcase_regex_pattern": "^x"},
+]
+
+
+@pytest.mark.parametrize('testcase', [
+    '',
+    'kernel-qe.test1',
+    'kernel-qe.kernel',
+    'kernel.tier1.test1',
+    'kernel.tier3.test1',
+    'greenwave-tests.test1',
+    'greenwave-tests.test12',
+    'x',
+    'unknown',
+])
+def test_permission_matcher_matches_same_permissions(testcase):
+    matcher = PermissionMatcher(EQUIVALENCE_PERMISSIONS)
+    expected = list(match_testcase_permissions(testcase, EQUIVALENCE_PERMISSIONS))
+    assert list(match_testcase_permissions(testcase, matcher)) == expected
+    # Memoized result
+    assert list(matcher.match(testcase)) == expected
+
+
+def test_permission_matcher_without_combined_regex():
+    permissions = [
+        {"name": "global flag", "_testcase_regex_pattern": "(?i)^kernel"},
+        {"name": "plain", "_testcase_regex_pattern": "^KERNEL"},
+    ]
+    matcher = PermissionMatcher(permissions)
+    assert list(matcher.match("Kernel")) == [permissions[0]]
+    assert list(matcher.match("KERNEL")) == permissions
+
+
+def test_permission_matcher_reused(app, monkeypatch):
+    permissions_config = [{"name": "all", "testcases": ["*"]}]
+    monkeypatch.setitem(app.config, 'PERMISSIONS', permissions_config)
+    matcher = permission_matcher()
+    assert permission_matcher() is matcher
+    assert matcher.permissions is permissions_config
+
+    monkeypatch.setitem(app.config, 'PERMISSIONS', [])
+    assert permission_matcher() is not matcher
@@ -2,10 +2,17 @@
 
 """This module contains tests for :mod:`waiverdb.events`."""
 from __future__ import unicode_literals
+import pytest
+import stomp
 from fedora_messaging import api, testing
+from fedora_messaging.exceptions import ConnectionException
 from flask_restful import marshal
-from waiverdb.models import Waiver
+from mock import patch
+from sqlalchemy import event
+from waiverdb.events import add_outbox_message, dispatch_outbox_messages
+from waiverdb.models import OutboxMessage, Waiver
 from waiverdb.fields import waiver_fields
+import waiverdb.monitor as monitor
 
 
 def test_publish_new_waiver_with_fedmsg(session):
@@ -53,3 +60,179 @@ def test_publish_new_waiver_with_fedmsg_for_proxy_user(session):
     )
     with testing.mock_sends(expected_msg):
         sesh.commit()
+
+
+def test_dispatch_outbox_messages(app, session, monkeypatch):
+    monkeypatch.setitem(app.config, 'MESSAGE_PUBLISHER', None)
+    event.listen(Waiver, 'after_insert', add_outbox_message)
+    try:
+        waiver = Waiver(
+            subject_type='koji_build',
+            subject_identifier='glibc-2.26-27.fc27',
+            testcase='testcase1',
+            username='jcline',
+            product_version='something',
+            waived=True,
+            comment='This is a comment',
+        )
+        sesh = session()
+        sesh.add(waiver)
+        sesh.commit()
+    finally:
+        event.remove(Waiver, 'after_insert', add_outbox_message)
+
+    assert OutboxMessage.query.count() == 1
+
+    expected_msg = api.Message(
+        topic='waiverdb.waiver.new',
+        body=marshal(waiver, waiver_fields)
+    )
+    monkeypatch.setitem(app.config, 'MESSAGE_PUBLISHER', 'fedmsg')
+    with testing.mock_sends(expected_msg):
+        assert dispatch_outbox_messages() == 1
+
+    assert OutboxMessage.query.count() == 0
+    assert dispatch_outbox_messages() == 0
+
+
+def test_dispatch_outbox_messages_keeps_failed_messages(app, session, monkeypatch):
+    monkeypatch.setitem(app.config, 'MESSAGE_PUBLISHER', 'fedmsg')
+    sesh = session()
+    sesh.add(OutboxMessage(topic='waiverdb.waiver.new', body='{"id": 1}'))
+    sesh.commit()
+
+    with patch('waiverdb.events.publish', side_effect=ConnectionException(reason='down')):
+        with pytest.raises(ConnectionException):
+            dispatch_outbox_messages()
+
+    messages = OutboxMessage.query.all()
+    assert len(messages) == 1
+    assert messages[0].attempts == 1
+
+
+def test_publish_new_waivers_in_batch_with_fedmsg(app, session, monkeypatch):
+    monkeypatch.setitem(app.config, 'MESSAGE_BATCH_PUBLISH', True)
+    waivers = [
+        Waiver(
+            subject_type='koji_build',
+            subject_identifier='glibc-2.26-27.fc27',
+            testcase='testcase%d' % i,
+            username='jcline',
+            product_version='something',
+            waived=True,
+            comment='This is a comment',
+        )
+        for i in range(3)
+    ]
+    sesh = session()
+    sesh.add_all(waivers)
+    sesh.flush()
+
+    expected_bodies = [marshal(waiver, waiver_fields) for waiver in waivers]
+    with patch('waiverdb.events.publish') as publish:
+        sesh.commit()
+
+    publish.assert_called_once()
+    msg = publish.call_args.args[0]
+    assert msg.topic == 'waiverdb.waivers.new'
+    assert sorted(msg.body['waivers'], key=lambda w: w['id']) == expected_bodies
+
+
+def test_publish_new_waivers_in_batch_with_stomp(app, session, monkeypatch):
+    monkeypatch.setitem(app.config, 'MESSAGE_BATCH_PUBLISH', True)
+    monkeypatch.setitem(app.config, 'MESSAGE_PUBLISHER', 'stomp')
+    monkeypatch.setitem(app.config, 'STOMP_CONFIGS', {
+        'destination': '/topic/VirtualTopic.eng.waiverdb.waiver.new',
+        'connection': {'host_and_ports': [('broker01', 61612)]},
+    })
+    waivers = [
+        Waiver(
+            subject_type='koji_build',
+            subject_identifier='glibc-2.26-27.fc27',
+            testcase='testcase%d' % i,
+            username='jcline',
+            product_version='something',
+        )
+        for i in range(3)
+    ]
+    sesh = session()
+    sesh.add_all(waivers)
+
+    with patch('waiverdb.events.stomp_connection') as stomp_connection:
+        conn = stomp_connection.return_value.__enter__.return_value
+        conn.begin.return_value = 'tx1'
+        sesh.commit()
+
+    conn.begin.assert_called_once_with()
+    assert conn.send.call_count == 3
+    assert all(c.kwargs['transaction'] == 'tx1' for c in conn.send.call_args_list)
+    conn.commit.assert_called_once_with('tx1')
+
+
+def test_publish_new_waivers_in_batch_with_stomp_aborted(app, session, monkeypatch):
+    monkeypatch.setitem(app.config, 'MESSAGE_BATCH_PUBLISH', True)
+    monkeypatch.setitem(app.config, 'MESSAGE_PUBLISHER', 'stomp')
+    monkeypatch.setitem(app.config, 'MAX_STOMP_RETRY', 1)
+    monkeypatch.setitem(app.config, 'STOMP_CONFIGS', {
+        'destination': '/topic/VirtualTopic.eng.waiverdb.waiver.new',
+        'connection': {'host_and_ports': [('broker01', 61612)]},
+    })
+    sesh = session()
+    sesh.add_all([
+        Waiver(
+            subject_type='koji_build',
+            subject_identifier='glibc-2.26-27.fc27',
+            testcase='testcase%d' % i,
+            username='jcline',
+            product_version='something',
+        )
+        for i in range(3)
+    ])
+
+    failed = monitor.messaging_tx_failed_counter._value.get()
+    with patch('waiverdb.events.stomp_connection') as stomp_connection:
+        conn = stomp_connection.return_value.__enter__.return_value
+        conn.begin.return_value = 'tx1'
+        conn.send.side_effect = [None, stomp.exception.StompException('send failed')]
+        sesh.commit()
+
+    assert conn.send.call_count == 2
+    conn.abort.assert_called_once_with('tx1')
+    conn.commit.assert_not_called()
+    assert monitor.messaging_tx_failed_counter._value.get() == failed + 3
+
+
+def test_publish_only_new_waivers(app, session):
+    sesh = session()
+    sesh.add(Waiver(
+        subject_type='koji_build',
+        subject_identifier='glibc-2.26-27.fc27',
+        testcase='testcase1',
+        username='jcline',
+        product_version='something',
+    ))
+    with patch('waiverdb.events.publish') as publish:
+        sesh.commit()
+    assert publish.call_count == 1
+
+    # Loaded waivers are not published again on later commits.
+    assert len(Waiver.query.all()) == 1
+    with patch('waiverdb.events.publish') as publish:
+        sesh.commit()
+    publish.assert_not_called()
+
+
+def test_rolled_back_waivers_are_not_published(app, session):
+    sesh = session()
+    sesh.add(Waiver(
+        subject_type='koji_build',
+        subject_identifier='glibc-2.26-27.fc27',
+        testcase='testcase1',
+        username='jcline',
+        product_version='something',
+    ))
+    sesh.flush()
+    sesh.rollback()
+    with patch('waiverdb.events.publish') as publish:
+        sesh.commit()
+    publish.assert_not_called()
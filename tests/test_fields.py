@@ -0,0 +1,24 @@
+# SPDX-License-Identifier: GPL-2.0+
+
+from flask_restful import marshal
+
+from .utils import create_waiver
+from waiverdb.fields import serialize_waiver, waiver_fields
+
+
+def test_serialize_waiver_matches_marshal(session):
+    waiver = create_waiver(session, subject_type='koji_build',
+                           subject_identifier='glibc-2.26-27.fc27',
+                           testcase='testcase1', username='foo',
+                           product_version='foo-1', comment='bla bla bla',
+                           proxied_by='bodhi', scenario='scenario1')
+    assert serialize_waiver(waiver) == marshal(waiver, waiver_fields)
+    assert list(serialize_waiver(waiver)) == list(waiver_fields)
+
+
+def test_serialize_compose_waiver_matches_marshal(session):
+    waiver = create_waiver(session, subject_type='compose',
+                           subject_identifier='Fedora-Rawhide-20170508.n.0',
+                           testcase='testcase1', username='foo',
+                           product_version='foo-1', waived=False)
+    assert serialize_waiver(waiver) == marshal(waiver, waiver_fields)
@@ -1,8 +1,11 @@
 # SPDX-License-Identifier: GPL-2.0+
 
 import pytest
+from sqlalchemy.sql.expression import func
 
-from waiverdb.models.waivers import subject_dict_to_type_identifier
+from .utils import create_waiver
+from waiverdb.models.waivers import (
+    LatestWaiver, Waiver, WaiverVersion, subject_dict_to_type_identifier)
 
 
 @pytest.mark.parametrize('subject,expected_type,expected_identifier', [
@@ -23,3 +26,46 @@ def test_subject_dict_to_type_identifier(subject, expected_type, expected_identi
     subject_type, subject_identifier = subject_dict_to_type_identifier(subject)
     assert subject_type == expected_type
     assert subject_identifier == expected_identifier
+
+
+def test_latest_waiver_tracks_most_recent_waiver(session):
+    old_waiver = create_waiver(session, subject_type='koji_build',
+                               subject_identifier='glibc-2.26-27.fc27',
+                               testcase='testcase1', username='foo',
+                               product_version='foo-1')
+    other_waiver = create_waiver(session, subject_type='koji_build',
+                                 subject_identifier='glibc-2.26-27.fc27',
+                                 testcase='testcase1', username='foo',
+                                 product_version='foo-2')
+    new_waiver = create_waiver(session, subject_type='koji_build',
+                               subject_identifier='glibc-2.26-27.fc27',
+                               testcase='testcase1', username='foo',
+                               product_version='foo-1', waived=False)
+    latest = session.query(LatestWaiver).order_by(LatestWaiver.product_version).all()
+    assert [w.waiver_id for w in latest] == [new_waiver.id, other_waiver.id]
+    assert old_waiver.id not in [w.waiver_id for w in latest]
+
+
+def test_latest_waiver_tracks_core_inserts(session):
+    waiver = create_waiver(session, subject_type='koji_build',
+                           subject_identifier='glibc-2.26-27.fc27',
+                           testcase='testcase1', username='foo',
+                           product_version='foo-1')
+    session.execute(Waiver.__table__.insert().values(
+        subject_type='koji_build', subject_identifier='glibc-2.26-27.fc27',
+        testcase='testcase1', username='foo', product_version='foo-1', waived=False))
+    new_id = session.query(func.max(Waiver.id)).scalar()
+    assert new_id > waiver.id
+    assert [w.waiver_id for w in session.query(LatestWaiver)] == [new_id]
+
+
+def test_waiver_version_bumped_on_insert(session):
+    assert session.query(WaiverVersion.version).scalar() == 0
+    create_waiver(session, subject_type='koji_build',
+                  subject_identifier='glibc-2.26-27.fc27',
+                  testcase='testcase1', username='foo',
+                  product_version='foo-1')
+    session.execute(Waiver.__table__.insert().values(
+        subject_type='koji_build', subject_identifier='glibc-2.26-27.fc27',
+        testcase='testcase2', username='foo', product_version='foo-1', waived=False))
+    assert session.query(WaiverVersion.version).scalar() == 2
@@ -6,6 +6,7 @@ import requests
 import waiverdb.monitor
 
 from six.moves import reload_module
+from sqlalchemy import create_engine
 
 
 def test_metrics(client):
@@ -18,6 +19,42 @@ def test_metrics(client):
     assert len([line for line in r.get_data(as_text=True).splitlines()
                 if line.startswith('# TYPE db_')
                 and line.endswith(' counter')]) == 4
+    assert len([line for line in r.get_data(as_text=True).splitlines()
+                if line.startswith('# TYPE stomp_')
+                and line.endswith(' counter')]) == 2
+
+
+def test_request_metrics(client, session):
+    registry = waiverdb.monitor.registry
+    labels = {'endpoint': 'api_v1.filteredwaiversresource', 'method': 'POST'}
+    count = registry.get_sample_value(
+        'http_request_duration_seconds_count', dict(labels, status='200')) or 0
+    size_count = registry.get_sample_value('http_response_size_bytes_count', labels) or 0
+
+    r = client.post('/api/v1.0/waivers/+filtered', json={'filters': [{'testcase': 'case'}]})
+    assert r.status_code == 200
+
+    assert registry.get_sample_value(
+        'http_request_duration_seconds_count', dict(labels, status='200')) == count + 1
+    assert registry.get_sample_value('http_response_size_bytes_count', labels) == size_count + 1
+    assert registry.get_sample_value('http_requests_in_progress', labels) == 0
+
+
+def test_db_pool_metrics():
+    engine = create_engine('sqlite://', poolclass=waiverdb.monitor.InstrumentedQueuePool)
+    waiverdb.monitor.db_hook_event_listeners(engine)
+    registry = waiverdb.monitor.registry
+    checked_out = waiverdb.monitor.db_pool_checked_out_gauge._value.get()
+    checkouts = registry.get_sample_value('db_pool_checkout_wait_seconds_count')
+    closed = registry.get_sample_value('db_connection_lifetime_seconds_count')
+
+    with engine.connect():
+        assert waiverdb.monitor.db_pool_checked_out_gauge._value.get() == checked_out + 1
+    assert waiverdb.monitor.db_pool_checked_out_gauge._value.get() == checked_out
+    assert registry.get_sample_value('db_pool_checkout_wait_seconds_count') == checkouts + 1
+
+    engine.dispose()
+    assert registry.get_sample_value('db_connection_lifetime_seconds_count') == closed + 1
 
 
 def test_standalone_metrics_server_disabled_by_default():
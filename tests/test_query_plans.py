@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Checks that the waiver lookups use the composite index on PostgreSQL.
+
+The plans are checked for the same queries the endpoints run.
+
+These tests are skipped unless WAIVERDB_TEST_POSTGRES_DB points to a
+PostgreSQL database. Beware that the tests drop and re-create all tables in
+the database.
+"""
+
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.expression import select
+
+from waiverdb.api_v1 import _filtered_waivers_query
+from waiverdb.models import db, Waiver
+
+POSTGRES_DB = os.environ.get('WAIVERDB_TEST_POSTGRES_DB')
+LOOKUP_INDEX = 'ix_waiver_subject_testcase_product_version'
+LATEST_WAIVER_INDEX = 'latest_waiver_pkey'
+
+pytestmark = pytest.mark.skipif(
+    not POSTGRES_DB, reason='WAIVERDB_TEST_POSTGRES_DB is not set')
+
+
+@pytest.fixture(scope='module')
+def connection(app):
+    engine = create_engine(POSTGRES_DB)
+    with engine.connect() as connection:
+        db.metadata.drop_all(connection)
+        db.metadata.create_all(connection)
+        connection.execute(text("""
+            INSERT INTO waiver (subject_type, subject_identifier, testcase, username,
+                                product_version, waived, comment, timestamp)
+            SELECT 'koji_build', 'pkg-1.0-' || i || '.fc38', 'case.' || (i % 50),
+                   'user', 'fedora-' || (i % 3), true, 'test', now()
+            FROM generate_series(1, 20000) AS i
+        """))
+        connection.execute(text('ANALYZE waiver'))
+        connection.execute(text('ANALYZE latest_waiver'))
+        yield connection
+        db.metadata.drop_all(connection)
+
+
+def plan_nodes(plan):
+    yield plan
+    for subplan in plan.get('Plans', []):
+        yield from plan_nodes(subplan)
+
+
+def explain(connection, filters, include_obsolete=False):
+    query = _filtered_waivers_query(filters, include_obsolete).statement
+    sql = str(query.compile(
+        dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+    result = connection.execute(text('EXPLAIN (FORMAT JSON) ' + sql)).scalar()
+    return list(plan_nodes(result[0]['Plan']))
+
+
+@pytest.mark.parametrize('filters', [
+    [{'subject_type': 'koji_build',
+      'subject_identifier': 'pkg-1.0-1.fc38',
+      'testcase': 'case.1'}],
+    [{'subject_type': 'koji_build',
+      'subject_identifier': 'pkg-1.0-%d.fc38' % i,
+      'testcase': 'case.%d' % (i % 50),
+      'product_version': 'fedora-%d' % (i % 3)}
+     for i in range(1, 101)],
+    [{'subject_type': 'koji_build',
+      'subject_identifier': 'pkg-1.0-1.fc38',
+      'testcase': 'case.1'},
+     {'subject_type': 'koji_build',
+      'subject_identifier': 'pkg-1.0-2.fc38',
+      'testcase': 'case.2',
+      'product_version': 'fedora-2'}],
+])
+def test_filtered_waivers_use_lookup_index(connection, filters):
+    nodes = explain(connection, filters)
+    assert not any(node['Node Type'] == 'Seq Scan' for node in nodes)
+    index_names = {node.get('Index Name') for node in nodes}
+    assert LOOKUP_INDEX in index_names
+    assert LATEST_WAIVER_INDEX in index_names
+
+
+def test_filtered_waivers_with_obsolete_use_lookup_index(connection):
+    nodes = explain(connection, [{
+        'subject_type': 'koji_build',
+        'subject_identifier': 'pkg-1.0-1.fc38',
+        'testcase': 'case.1',
+    }], include_obsolete=True)
+    assert not any(node['Node Type'] == 'Seq Scan' for node in nodes)
+    assert LOOKUP_INDEX in {node.get('Index Name') for node in nodes}
+
+
+def test_recent_waivers_use_timestamp_index(connection):
+    query = select(Waiver.__table__).where(
+        Waiver.timestamp >= text("now() - interval '1 hour'")
+    ).order_by(Waiver.timestamp.desc(), Waiver.id.desc()).limit(10)
+    sql = str(query.compile(
+        dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+    result = connection.execute(text('EXPLAIN (FORMAT JSON) ' + sql)).scalar()
+    nodes = list(plan_nodes(result[0]['Plan']))
+    assert not any(node['Node Type'] == 'Sort' for node in nodes)
+    assert 'ix_waiver_timestamp_id' in {node.get('Index Name') for node in nodes}
+
+
+def test_filtered_waivers_ordered_by_lookup_index(connection):
+    nodes = explain(connection, [{
+        'subject_type': 'koji_build',
+        'subject_identifier': 'pkg-1.0-1.fc38',
+        'testcase': 'case.1',
+        'product_version': 'fedora-1',
+    }])
+    assert LOOKUP_INDEX in {node.get('Index Name') for node in nodes}
+    assert not any(node['Node Type'] == 'Sort' for node in nodes)
@@ -0,0 +1,130 @@
+# SPDX-License-Identifier: GPL-2.0+
+
+import json
+import time
+
+import pytest
+from flask import g
+from mock import Mock, patch
+from sqlalchemy.exc import OperationalError
+
+from .utils import create_waiver
+from waiverdb.cache import LocalCache
+from waiverdb.models import db
+from waiverdb.replicas import (
+    PRIMARY_PIN_COOKIE,
+    ReplicaSelector,
+    replica_binds,
+    use_replica,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_replica(app):
+    yield
+    # The tests share single application context.
+    g.pop('db_replica', None)
+
+
+@pytest.fixture
+def replica_selector(app):
+    selector = ReplicaSelector(replica_binds(['sqlite://', 'sqlite://']))
+    with patch.object(app, 'replica_selector', selector):
+        yield selector
+
+
+def test_replica_selector_round_robin():
+    selector = ReplicaSelector(['replica_0', 'replica_1'])
+    assert [selector.choose() for _ in range(3)] == ['replica_0', 'replica_1', 'replica_0']
+
+
+def test_replica_selector_skips_failed_replicas():
+    selector = ReplicaSelector(['replica_0', 'replica_1'], retry_delay=30)
+    selector.mark_failed('replica_0')
+    assert [selector.choose() for _ in range(2)] == ['replica_1', 'replica_1']
+    selector.mark_failed('replica_1')
+    assert selector.choose() is None
+
+    with patch('waiverdb.replicas.time.monotonic', return_value=time.monotonic() + 31):
+        assert selector.choose() == 'replica_0'
+
+
+def test_session_uses_selected_replica(app):
+    replica_engine = Mock()
+    with app.test_request_context(), patch.dict(db.engines, {'replica_0': replica_engine}):
+        assert db.session.get_bind() is not replica_engine
+        g.db_replica = 'replica_0'
+        assert db.session.get_bind() is replica_engine
+
+
+def test_use_replica(app, replica_selector):
+    view = use_replica(lambda: g.get('db_replica'))
+    with app.test_request_context():
+        assert view() == 'replica_0'
+        assert view() == 'replica_1'
+
+
+def test_use_replica_falls_back_to_primary(app, replica_selector):
+    calls = []
+
+    def view():
+        calls.append(g.get('db_replica'))
+        if len(calls) == 1:
+            raise OperationalError('SELECT 1', {}, Exception('connection refused'))
+        return 'ok'
+
+    with app.test_request_context():
+        assert use_replica(view)() == 'ok'
+    assert calls == ['replica_0', None]
+    assert replica_selector.choose() == 'replica_1'
+    assert replica_selector.choose() == 'replica_1'
+
+
+def test_use_replica_pinned_to_primary(app, replica_selector):
+    view = use_replica(lambda: g.get('db_replica'))
+    cookie = '%s=%s' % (PRIMARY_PIN_COOKIE, time.time() + 10)
+    with app.test_request_context(headers={'Cookie': cookie}):
+        assert view() is None
+        assert 'db_replica' not in g
+
+    cookie = '%s=%s' % (PRIMARY_PIN_COOKIE, time.time() - 10)
+    with app.test_request_context(headers={'Cookie': cookie}):
+        assert view() == 'replica_0'
+
+
+def test_create_waiver_pins_client_to_primary(client, session, replica_selector):
+    data = {
+        'subject_type': 'koji_build',
+        'subject_identifier': 'glibc-2.26-27.fc27',
+        'testcase': 'testcase1',
+        'product_version': 'fool-1',
+        'waived': True,
+        'comment': 'it broke',
+    }
+    with patch('waiverdb.auth.get_user', return_value=('foo', {})):
+        r = client.post('/api/v1.0/waivers/', data=json.dumps(data),
+                        content_type='application/json')
+    assert r.status_code == 201
+    cookie = r.headers['Set-Cookie']
+    assert cookie.startswith(PRIMARY_PIN_COOKIE + '=')
+    assert 'Max-Age=10' in cookie
+
+
+def test_filtered_waivers_from_replica_not_cached(client, session, replica_selector, app):
+    create_waiver(session, subject_type='koji_build',
+                  subject_identifier='glibc-2.26-27.fc27',
+                  testcase='testcase1', username='foo',
+                  product_version='foo-1')
+    session.commit()
+    cache = LocalCache(max_size=10, ttl=60)
+    # Use the test connection for the replicas.
+    engines = {bind_key: db.get_engine() for bind_key in replica_selector.bind_keys}
+    with patch.object(app, 'filtered_waivers_cache', cache, create=True), \
+            patch.dict(db.engines, engines), \
+            patch.object(cache, 'set', wraps=cache.set) as mocked_set:
+        r = client.post('/api/v1.0/waivers/+filtered',
+                        json={'filters': [{'testcase': 'testcase1'}]})
+        assert r.status_code == 200
+        assert len(r.json['data']) == 1
+        assert g.db_replica == 'replica_0'
+        mocked_set.assert_not_called()
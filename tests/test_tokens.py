@@ -0,0 +1,139 @@
+# SPDX-License-Identifier: GPL-2.0+
+
+import json
+import time
+
+import mock
+import pytest
+from flask import g
+from werkzeug.exceptions import Unauthorized
+
+from waiverdb.cache import LocalCache
+from waiverdb.tokens import TokenValidator
+
+SCOPES = ['openid', 'waiverdb_scope']
+
+
+def mocked_oidc(token_info):
+    def validate_token(token, scopes_required):
+        g.oidc_token_info = token_info
+        return True
+
+    oidc = mock.Mock()
+    oidc.validate_token.side_effect = validate_token
+    return oidc
+
+
+def test_introspected_token_is_cached(app):
+    oidc = mocked_oidc({'active': True, 'username': 'foo', 'scope': 'openid waiverdb_scope'})
+    validator = TokenValidator(oidc, cache=LocalCache(max_size=10, ttl=60))
+    for _ in range(3):
+        assert validator.validate('token', SCOPES)['username'] == 'foo'
+    oidc.validate_token.assert_called_once_with('token', SCOPES)
+
+    validator.validate('other-token', SCOPES)
+    assert oidc.validate_token.call_count == 2
+
+
+def test_expired_token_is_not_cached(app):
+    oidc = mocked_oidc({
+        'active': True,
+        'username': 'foo',
+        'scope': 'openid waiverdb_scope',
+        'exp': time.time() - 1,
+    })
+    validator = TokenValidator(oidc, cache=LocalCache(max_size=10, ttl=60))
+    for _ in range(2):
+        validator.validate('token', SCOPES)
+    assert oidc.validate_token.call_count == 2
+
+
+def test_cached_token_requires_scopes(app):
+    oidc = mocked_oidc({'active': True, 'username': 'foo', 'scope': 'openid'})
+    validator = TokenValidator(oidc, cache=LocalCache(max_size=10, ttl=60))
+    validator.validate('token', ['openid'])
+    with pytest.raises(Unauthorized) as excinfo:
+        validator.validate('token', SCOPES)
+    assert 'Token does not have required scopes' in excinfo.value.get_description()
+    oidc.validate_token.assert_called_once()
+
+
+def test_invalid_introspected_token(app):
+    oidc = mock.Mock()
+    oidc.validate_token.return_value = 'Token required but invalid'
+    validator = TokenValidator(oidc, cache=LocalCache(max_size=10, ttl=60))
+    for _ in range(2):
+        with pytest.raises(Unauthorized):
+            validator.validate('token', SCOPES)
+    assert oidc.validate_token.call_count == 2
+
+
+@pytest.fixture
+def jwt_key():
+    jwt = pytest.importorskip('jwt')
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    jwk['kid'] = 'key1'
+    with mock.patch('jwt.PyJWKClient.fetch_data', return_value={'keys': [jwk]}) as fetch_data:
+        yield key, fetch_data
+
+
+def make_jwt(key, **claims):
+    import jwt
+    claims.setdefault('exp', int(time.time()) + 60)
+    return jwt.encode(claims, key, algorithm='RS256', headers={'kid': 'key1'})
+
+
+def test_jwt_verified_with_cached_jwks(jwt_key):
+    key, fetch_data = jwt_key
+    oidc = mock.Mock()
+    validator = TokenValidator(
+        oidc, jwks_uri='https://id.example.com/jwks', issuer='https://id.example.com',
+        username_field='preferred_username')
+    for user in ('foo', 'bar'):
+        token = make_jwt(
+            key, iss='https://id.example.com', preferred_username=user,
+            scope='openid waiverdb_scope')
+        assert validator.validate(token, SCOPES)['username'] == user
+    fetch_data.assert_called_once()
+    oidc.validate_token.assert_not_called()
+
+
+def test_jwt_cached(jwt_key):
+    import jwt
+    key, _ = jwt_key
+    validator = TokenValidator(
+        mock.Mock(), cache=LocalCache(max_size=10, ttl=60),
+        jwks_uri='https://id.example.com/jwks')
+    token = make_jwt(key, username='foo', scope='openid waiverdb_scope')
+    with mock.patch('jwt.decode', wraps=jwt.decode) as decode:
+        for _ in range(3):
+            assert validator.validate(token, SCOPES)['username'] == 'foo'
+    decode.assert_called_once()
+
+
+@pytest.mark.parametrize('claims', [
+    {'username': 'foo', 'scope': 'openid waiverdb_scope', 'exp': int(time.time()) - 60},
+    {'username': 'foo', 'scope': 'openid waiverdb_scope', 'iss': 'https://evil.example.com'},
+    {'username': 'foo', 'scope': 'openid'},
+])
+def test_invalid_jwt(jwt_key, claims):
+    key, _ = jwt_key
+    validator = TokenValidator(
+        mock.Mock(), cache=LocalCache(max_size=10, ttl=60),
+        jwks_uri='https://id.example.com/jwks', issuer='https://id.example.com')
+    token = make_jwt(key, **claims)
+    with pytest.raises(Unauthorized):
+        validator.validate(token, SCOPES)
+
+
+def test_jwt_with_invalid_signature(jwt_key):
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    validator = TokenValidator(mock.Mock(), jwks_uri='https://id.example.com/jwks')
+    token = make_jwt(other_key, username='foo', scope='openid waiverdb_scope')
+    with pytest.raises(Unauthorized) as excinfo:
+        validator.validate(token, SCOPES)
+    assert 'Token required but invalid' in excinfo.value.get_description()
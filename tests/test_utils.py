@@ -0,0 +1,68 @@
+# SPDX-License-Identifier: GPL-2.0+
+
+import pytest
+from mock import patch
+
+import waiverdb.monitor as monitor
+from waiverdb.utils import StompConnectionManager
+
+STOMP_CONFIGS = {
+    'destination': '/topic/VirtualTopic.eng.waiverdb.waiver.new',
+    'connection': {
+        'host_and_ports': [('broker01', 61612)],
+    },
+}
+
+
+@pytest.fixture
+def stomp_connection_class():
+    with patch('waiverdb.utils.stomp.connect.StompConnection11') as connection_class:
+        connection_class.return_value.is_connected.return_value = True
+        yield connection_class
+
+
+def test_stomp_connection_manager_reuses_connection(stomp_connection_class):
+    manager = StompConnectionManager()
+    connect_count = monitor.stomp_connect_counter._value.get()
+
+    with manager.connection(STOMP_CONFIGS) as conn1:
+        pass
+    with manager.connection(STOMP_CONFIGS) as conn2:
+        pass
+
+    assert conn1 is conn2
+    assert stomp_connection_class.call_count == 1
+    conn1.connect.assert_called_once_with(wait=True)
+    conn1.disconnect.assert_not_called()
+    assert monitor.stomp_connect_counter._value.get() == connect_count + 1
+
+    manager.close()
+    conn1.disconnect.assert_called_once_with()
+
+
+def test_stomp_connection_manager_reconnects_after_failure(stomp_connection_class):
+    manager = StompConnectionManager()
+    reconnect_count = monitor.stomp_reconnect_counter._value.get()
+
+    with pytest.raises(RuntimeError):
+        with manager.connection(STOMP_CONFIGS):
+            raise RuntimeError('send failed')
+    stomp_connection_class.return_value.disconnect.assert_called_once_with()
+
+    with manager.connection(STOMP_CONFIGS):
+        pass
+
+    assert stomp_connection_class.call_count == 2
+    assert monitor.stomp_reconnect_counter._value.get() == reconnect_count + 1
+
+
+def test_stomp_connection_manager_reconnects_if_disconnected(stomp_connection_class):
+    manager = StompConnectionManager()
+
+    with manager.connection(STOMP_CONFIGS):
+        pass
+    stomp_connection_class.return_value.is_connected.return_value = False
+    with manager.connection(STOMP_CONFIGS):
+        pass
+
+    assert stomp_connection_class.call_count == 2
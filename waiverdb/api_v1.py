@@ -1,29 +1,49 @@
 # SPDX-License-Identifier: GPL-2.0+
 
 import datetime
+import json
 import logging
 
 import requests
-from flask import Blueprint, render_template, request, current_app, Response
+from flask import Blueprint, render_template, request, current_app, Response, g
 from flask_oidc import OpenIDConnect
-from flask_restful import Resource, Api, reqparse, marshal_with, marshal
+from flask_restful import Resource, Api, reqparse, marshal_with
 from werkzeug.exceptions import (
     BadRequest,
     Forbidden,
+    NotFound,
     ServiceUnavailable,
 )
-from sqlalchemy.sql.expression import func, and_, or_
+from sqlalchemy.sql.expression import and_, or_, tuple_
 
 from waiverdb import __version__
-from waiverdb.authorization import match_testcase_permissions, verify_authorization
+from waiverdb.authorization import (
+    AuthorizationContext,
+    LdapConnectionPool,
+    PermissionMatcher,
+    match_testcase_permissions,
+)
+from waiverdb.cache import make_cache_key
 from waiverdb.models import db
-from waiverdb.models.waivers import Waiver, subject_dict_to_type_identifier
-from waiverdb.utils import json_collection, jsonp
-from waiverdb.fields import waiver_fields
+from waiverdb.models.waivers import (
+    LatestWaiver, Waiver, WaiverVersion, subject_dict_to_type_identifier)
+from waiverdb.replicas import pin_to_primary, use_replica
+from waiverdb.utils import (
+    COUNT_MODES,
+    conditional_get,
+    json_collection,
+    json_cursor_collection,
+    json_stream_collection,
+    jsonp,
+    make_etag,
+)
+from waiverdb.fields import serialize_waiver, waiver_field_columns, waiver_fields
 import waiverdb.auth
+import waiverdb.monitor as monitor
 
 api_v1 = (Blueprint('api_v1', __name__))
 api = Api(api_v1)
+monitor.register_request_metrics(api_v1)
 requests_session = requests.Session()
 log = logging.getLogger(__name__)
 oidc = OpenIDConnect()
@@ -65,6 +85,33 @@ def valid_filter_list(filters):
     return filters
 
 
+def valid_id_list(ids):
+    if (not isinstance(ids, list) or not ids
+            or not all(isinstance(id_, int) and not isinstance(id_, bool) for id_ in ids)):
+        raise ValueError('Must be a non-empty list of waiver IDs')
+    return ids
+
+
+def valid_waiver_fields(value):
+    """
+    Parses list of waiver field names to return, either a list or
+    a comma-separated string.
+
+    Returns the field names in the default order.
+    """
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError('Must be a list of field names')
+    names = {item.strip() for item in value if item.strip()}
+    if not names:
+        raise ValueError('Must be a non-empty list of field names')
+    unknown = names.difference(waiver_fields)
+    if unknown:
+        raise ValueError('Unknown fields: %s' % ', '.join(sorted(unknown)))
+    return [name for name in waiver_fields if name in names]
+
+
 def reqparse_since(since):
     """
     Parses the 'since' query parameter, which is expected to be either a
@@ -92,11 +139,59 @@ def reqparse_since(since):
     return start, end
 
 
+def ldap_connection_pool(ldap_host):
+    """
+    Returns LDAP connection pool for the host, shared by all requests in the
+    process.
+    """
+    if not ldap_host:
+        return None
+    pools = current_app.ldap_connection_pools
+    pool = pools.get(ldap_host)
+    if pool is None:
+        config = current_app.config
+        pool = pools.setdefault(ldap_host, LdapConnectionPool(
+            ldap_host,
+            max_size=config['LDAP_POOL_SIZE'],
+            network_timeout=config['LDAP_NETWORK_TIMEOUT'],
+            timeout=config['LDAP_TIMEOUT'],
+            failure_threshold=config['LDAP_FAILURE_THRESHOLD'],
+            retry_delay=config['LDAP_RETRY_DELAY'],
+        ))
+    return pool
+
+
+def permission_matcher():
+    """
+    Return PermissionMatcher for the current permissions configuration.
+
+    The matcher is created once and reused until PERMISSIONS or
+    PERMISSION_MAPPING options are replaced.
+    """
+    config_key = (
+        current_app.config.get('PERMISSIONS'),
+        current_app.config.get('PERMISSION_MAPPING'),
+    )
+    cached = getattr(current_app, 'permission_matcher', None)
+    if cached is not None:
+        cached_key, matcher = cached
+        if all(a is b for a, b in zip(cached_key, config_key)):
+            return matcher
+
+    matcher = PermissionMatcher(_permissions())
+    current_app.permission_matcher = (config_key, matcher)
+    return matcher
+
+
 def permissions():
     """
     Return PERMISSIONS configuration.
     PERMISSION_MAPPING converted to the new format.
     """
+    return permission_matcher().permissions
+
+
+def _permissions():
     permissions_config = current_app.config.get('PERMISSIONS')
     if permissions_config:
         return permissions_config
@@ -117,23 +212,192 @@ def permissions():
     return []
 
 
+# Waivers are listed from the most recent one, which can be served by walking
+# the (timestamp, id) index backwards. This is only roughly the insertion
+# order: timestamps come from the clocks of the application hosts and are
+# assigned before the id, so concurrent inserts can be ordered differently.
+WAIVER_ORDER = (Waiver.timestamp.desc(), Waiver.id.desc())
+
+
+def _waivers_query(fields=None):
+    """
+    Returns query for waivers selecting only the columns needed to serialize
+    the given fields (all fields by default).
+
+    Unlike ``Waiver.query``, this returns lightweight rows instead of ORM
+    objects, which are not tracked in the session identity map.
+    """
+    # id and timestamp are always needed for ordering and pagination
+    names = {'id', 'timestamp'}
+    for field in fields or waiver_fields:
+        names.update(waiver_field_columns[field])
+    columns = [
+        getattr(Waiver, column.name)
+        for column in Waiver.__table__.columns
+        if column.name in names
+    ]
+    return db.session.query(*columns)
+
+
+def _waivers_conditional_get():
+    """
+    Handles conditional GET request for waiver collections.
+
+    Waivers are never modified or deleted, so any response depends only on
+    the request and the set of committed waivers, which is identified by the
+    counter in the ``waiver_version`` table. Ids and timestamps are assigned
+    before commit, so transactions can commit out of order; the counter,
+    unlike the highest id, changes with every commit.
+
+    Last-Modified is not sent for the same reason (and because it has only
+    one second resolution).
+    """
+    version = db.session.query(WaiverVersion.version).filter_by(id=1).scalar()
+    etag = make_etag(__version__, version, request.full_path)
+    return conditional_get(etag)
+
+
 def _filter_out_obsolete_waivers(query):
     """
     Filters out obsolete waivers.
 
     A waiver is obsolete if there exist another one that is more recent with
     same subject, test case name, username and product_version.
+
+    The most recent waivers are tracked in the ``latest_waiver`` table so the
+    waiver history does not have to be aggregated.
     """
-    subquery = db.session.query(func.max(Waiver.id)).group_by(
-        Waiver.subject_type,
-        Waiver.subject_identifier,
-        Waiver.testcase,
-        Waiver.username,
-        Waiver.product_version,
-    )
+    subquery = db.session.query(LatestWaiver.waiver_id)
     return query.filter(Waiver.id.in_(subquery))
 
 
+def _filter_out_superseded_waivers(query):
+    """
+    Filters out waivers for which there is a more recent waiver for the same
+    subject and test case (from any user and for any product version).
+
+    The most recent waiver for subject and test case is the most recent one
+    among the latest waivers for each user and product version, so only the
+    ``latest_waiver`` rows with the subject and test case of each matching
+    waiver are looked up (using the primary key of the table).
+    """
+    newer = db.session.query(LatestWaiver.waiver_id).filter(
+        LatestWaiver.subject_type == Waiver.subject_type,
+        LatestWaiver.subject_identifier == Waiver.subject_identifier,
+        LatestWaiver.testcase == Waiver.testcase,
+        LatestWaiver.waiver_id > Waiver.id,
+    )
+    return query.filter(~newer.exists())
+
+
+# Filter keys from /waivers/+filtered which are matched by equality.
+FILTER_EQUALITY_COLUMNS = {
+    'subject_type': Waiver.subject_type,
+    'subject_identifier': Waiver.subject_identifier,
+    'testcase': Waiver.testcase,
+    'scenario': Waiver.scenario,
+    'product_version': Waiver.product_version,
+    'username': Waiver.username,
+    'proxied_by': Waiver.proxied_by,
+}
+
+
+def _filter_values(args, name):
+    """
+    Returns list of values for a filter query parameter from
+    :http:get:`/api/v1.0/waivers/`, which can be repeated or contain
+    comma-separated values.
+    """
+    values = []
+    for value in args[name] or ():
+        values.extend(item for item in value.split(',') if item)
+    values = list(dict.fromkeys(values))
+    max_values = current_app.config['MAX_FILTER_VALUES']
+    if len(values) > max_values:
+        raise BadRequest({name: 'Too many values, at most %d are allowed' % max_values})
+    return values
+
+
+def _homogeneous_filters_clause(filters):
+    """
+    Returns a single IN clause matching any of the filters if all of them
+    contain string values for the same set of equality keys and nothing
+    else; otherwise returns None.
+
+    This avoids generating a long chain of ORs, which is slow to plan for
+    large filter lists.
+    """
+    keys = None
+    for filter_ in filters:
+        if keys is None:
+            keys = sorted(filter_.keys())
+        if sorted(filter_.keys()) != keys:
+            return None
+        if not all(isinstance(filter_[key], str) for key in keys):
+            return None
+    if not keys or any(key not in FILTER_EQUALITY_COLUMNS for key in keys):
+        return None
+
+    if len(keys) == 1:
+        key = keys[0]
+        return FILTER_EQUALITY_COLUMNS[key].in_({filter_[key] for filter_ in filters})
+
+    columns = tuple_(*(FILTER_EQUALITY_COLUMNS[key] for key in keys))
+    values = {tuple(filter_[key] for key in keys) for filter_ in filters}
+    return columns.in_(values)
+
+
+def _filters_clause(filters):
+    """
+    Returns clause matching waivers with any of the filters from
+    /waivers/+filtered.
+    """
+    clause = _homogeneous_filters_clause(filters)
+    if clause is not None:
+        return clause
+
+    clauses = []
+    for filter_ in filters:
+        inner_clauses = []
+        if 'subject_type' in filter_:
+            inner_clauses.append(Waiver.subject_type == filter_['subject_type'])
+        if 'subject_identifier' in filter_:
+            inner_clauses.append(Waiver.subject_identifier == filter_['subject_identifier'])
+        if 'testcase' in filter_:
+            inner_clauses.append(Waiver.testcase == filter_['testcase'])
+        if 'scenario' in filter_:
+            inner_clauses.append(Waiver.scenario == filter_['scenario'])
+        if 'product_version' in filter_:
+            inner_clauses.append(Waiver.product_version == filter_['product_version'])
+        if 'username' in filter_:
+            inner_clauses.append(Waiver.username == filter_['username'])
+        if 'proxied_by' in filter_:
+            inner_clauses.append(Waiver.proxied_by == filter_['proxied_by'])
+        if 'since' in filter_:
+            try:
+                since_start, since_end = reqparse_since(filter_['since'])
+            except ValueError as e:
+                raise BadRequest({'since': str(e)})
+            if since_start:
+                inner_clauses.append(Waiver.timestamp >= since_start)
+            if since_end:
+                inner_clauses.append(Waiver.timestamp <= since_end)
+        clauses.append(and_(*inner_clauses))
+    return or_(*clauses)
+
+
+def _filtered_waivers_query(filters, include_obsolete, fields=None):
+    """
+    Returns query for waivers matching any of the filters from
+    /waivers/+filtered, ordered from the most recent one.
+    """
+    query = _waivers_query(fields).order_by(*WAIVER_ORDER)
+    query = query.filter(_filters_clause(filters))
+    if not include_obsolete:
+        query = _filter_out_superseded_waivers(query)
+    return query
+
+
 # RP contains request parsers (reqparse.RequestParser).
 #    Parsers are added in each 'resource section' for better readability
 RP = {}
@@ -159,19 +423,22 @@ RP['create_waiver_form'].add_argument('comment', type=str, required=True, locati
 RP['create_waiver_form'].add_argument('scenario', type=str, default=None, location='form')
 
 RP['get_waivers'] = reqparse.RequestParser()
-RP['get_waivers'].add_argument('subject_type', location='args')
-RP['get_waivers'].add_argument('subject_identifier', location='args')
-RP['get_waivers'].add_argument('testcase', location='args')
-RP['get_waivers'].add_argument('product_version', location='args')
-RP['get_waivers'].add_argument('username', location='args')
+RP['get_waivers'].add_argument('subject_type', action='append', location='args')
+RP['get_waivers'].add_argument('subject_identifier', action='append', location='args')
+RP['get_waivers'].add_argument('testcase', action='append', location='args')
+RP['get_waivers'].add_argument('product_version', action='append', location='args')
+RP['get_waivers'].add_argument('username', action='append', location='args')
 RP['get_waivers'].add_argument('include_obsolete', type=bool, default=False, location='args')
-RP['get_waivers'].add_argument('scenario', type=str, default=None, location='args')
+RP['get_waivers'].add_argument('scenario', action='append', location='args')
 # XXX This matches the since query parameter in resultsdb but I think it would
 # be good to use two parameters(since and until).
 RP['get_waivers'].add_argument('since', type=reqparse_since, location='args')
 RP['get_waivers'].add_argument('page', default=1, type=int, location='args')
 RP['get_waivers'].add_argument('limit', default=10, type=int, location='args')
-RP['get_waivers'].add_argument('proxied_by', location='args')
+RP['get_waivers'].add_argument('cursor', type=str, location='args')
+RP['get_waivers'].add_argument('count', choices=COUNT_MODES, default='exact', location='args')
+RP['get_waivers'].add_argument('fields', type=valid_waiver_fields, location='args')
+RP['get_waivers'].add_argument('proxied_by', action='append', location='args')
 
 RP['get_permissions'] = reqparse.RequestParser()
 RP['get_permissions'].add_argument('testcase', location='args')
@@ -179,6 +446,12 @@ RP['get_permissions'].add_argument('testcase', location='args')
 RP['filter_waivers'] = reqparse.RequestParser()
 RP['filter_waivers'].add_argument('filters', type=valid_filter_list, required=True, location='json')
 RP['filter_waivers'].add_argument('include_obsolete', type=bool, default=False, location='json')
+RP['filter_waivers'].add_argument('stream', type=bool, default=False, location='json')
+RP['filter_waivers'].add_argument('fields', type=valid_waiver_fields, location='json')
+
+RP['get_waivers_by_ids'] = reqparse.RequestParser()
+RP['get_waivers_by_ids'].add_argument('ids', type=valid_id_list, required=True, location='json')
+RP['get_waivers_by_ids'].add_argument('fields', type=valid_waiver_fields, location='json')
 
 RP['get_waivers_by_subjects_and_testcase'] = rp = reqparse.RequestParser()
 rp.add_argument('results', type=valid_results_list, location='json')
@@ -188,6 +461,8 @@ rp.add_argument('username', type=str, location='json')
 rp.add_argument('proxied_by', location='json')
 rp.add_argument('since', type=reqparse_since, location='json')
 rp.add_argument('include_obsolete', type=bool, default=False, location='json')
+rp.add_argument('stream', type=bool, default=False, location='json')
+rp.add_argument('fields', type=valid_waiver_fields, location='json')
 
 
 class DummyJsonRequest(object):
@@ -201,6 +476,7 @@ class DummyJsonRequest(object):
 
 class WaiversResource(Resource):
     @jsonp
+    @use_replica
     def get(self):
         """
         Get waiver records.
@@ -232,9 +508,32 @@ class WaiversResource(Resource):
                "prev": null
            }
 
+        Waivers are ordered from the most recently created one (by
+        ``timestamp`` and then by ``id``).
+
+        The filter parameters (``subject_type``, ``subject_identifier``,
+        ``testcase``, ``scenario``, ``product_version``, ``username`` and
+        ``proxied_by``) can be repeated or contain comma-separated values to
+        include waivers matching any of the values (e.g.
+        ``testcase=a&testcase=b`` or ``testcase=a,b``). The number of values
+        for each parameter is limited by ``MAX_FILTER_VALUES`` option (100 by
+        default).
 
         :query int page: The page to get.
         :query int limit: Limit the number of items returned.
+        :query string cursor: Use keyset pagination instead of page numbers.
+            Pass an empty value to get the first page, then follow the
+            ``next`` and ``prev`` links, which contain opaque cursors. In this
+            mode the total number of waivers is not computed, so ``last`` is
+            always null and the ``page`` parameter is ignored.
+        :query string count: How to compute the total number of waivers for
+            the ``last`` link: ``exact`` (default) counts them, ``estimate``
+            uses a cheap estimate from the database query planner (the link
+            may be off) and ``none`` skips it and sets ``last`` to null.
+        :query string fields: Comma-separated list of waiver fields to return
+            (e.g. ``subject_type,subject_identifier,testcase,scenario,waived``).
+            Only the columns needed for these fields are fetched from the
+            database. By default, all fields are returned.
         :query string subject_type: Only include waivers for the given subject type.
         :query string subject_identifier: Only include waivers for the given subject identifier.
         :query string testcase: Only include waivers for the given test case name.
@@ -252,25 +551,23 @@ class WaiversResource(Resource):
         :query boolean include_obsolete: If true, obsolete waivers will be included.
         :statuscode 200: If the query was valid and no problems were encountered.
             Note that the response may still contain 0 waivers.
+        :statuscode 304: The waivers have not changed since the response
+            identified by the ``If-None-Match`` header.
         :statuscode 400: The request was malformed and could not be processed.
         """
         args = RP['get_waivers'].parse_args()
-        query = Waiver.query.order_by(Waiver.timestamp.desc())
-
-        if args['subject_type']:
-            query = query.filter(Waiver.subject_type == args['subject_type'])
-        if args['subject_identifier']:
-            query = query.filter(Waiver.subject_identifier == args['subject_identifier'])
-        if args['testcase']:
-            query = query.filter(Waiver.testcase == args['testcase'])
-        if args['scenario']:
-            query = query.filter(Waiver.scenario == args['scenario'])
-        if args['product_version']:
-            query = query.filter(Waiver.product_version == args['product_version'])
-        if args['username']:
-            query = query.filter(Waiver.username == args['username'])
-        if args['proxied_by']:
-            query = query.filter(Waiver.proxied_by == args['proxied_by'])
+        not_modified = _waivers_conditional_get()
+        if not_modified is not None:
+            return not_modified
+
+        query = _waivers_query(args['fields'])
+
+        for name, column in FILTER_EQUALITY_COLUMNS.items():
+            values = _filter_values(args, name)
+            if len(values) == 1:
+                query = query.filter(column == values[0])
+            elif values:
+                query = query.filter(column.in_(values))
         if args['since']:
             since_start, since_end = args['since']
             if since_start:
@@ -280,8 +577,14 @@ class WaiversResource(Resource):
         if not args['include_obsolete']:
             query = _filter_out_obsolete_waivers(query)
 
-        query = query.order_by(Waiver.timestamp.desc())
-        return json_collection(query, args['page'], args['limit'])
+        if args['cursor'] is not None:
+            return json_cursor_collection(
+                query, Waiver.timestamp, Waiver.id, args['cursor'], args['limit'],
+                args['fields'])
+
+        query = query.order_by(*WAIVER_ORDER)
+        return json_collection(
+            query, args['page'], args['limit'], args['fields'], args['count'])
 
     @jsonp
     @marshal_with(waiver_fields)
@@ -358,10 +661,12 @@ class WaiversResource(Resource):
 
         if isinstance(data, list):
             result = []
+            # Each distinct user and test case is authorized only once.
+            authorization = self._authorization_context()
             for sub_data in data:
                 sub_request = DummyJsonRequest(sub_data)
                 args = RP['create_waiver'].parse_args(sub_request)
-                one_result = self._create_waiver(args, user)
+                one_result = self._create_waiver(args, user, authorization)
                 result.append(one_result)
             db.session.add_all(result)
         else:
@@ -370,12 +675,18 @@ class WaiversResource(Resource):
             db.session.add(result)
 
         db.session.commit()
+        pin_to_primary()
 
         return result, 201, headers
 
-    def _verify_authorization(self, user, testcase):
-        if not permissions():
-            return True
+    def _authorization_context(self):
+        """
+        Returns AuthorizationContext for verifying permissions of waivers
+        created in the current request, or None if permissions are not set.
+        """
+        matcher = permission_matcher()
+        if not matcher.permissions:
+            return None
 
         ldap_host = current_app.config.get('LDAP_HOST')
         ldap_searches = current_app.config.get('LDAP_SEARCHES')
@@ -386,9 +697,13 @@ class WaiversResource(Resource):
                     'LDAP_SEARCH_STRING', '(memberUid={user})'
                 )
                 ldap_searches = [{'BASE': ldap_base, 'SEARCH_STRING': ldap_search_string}]
-        return verify_authorization(user, testcase, permissions(), ldap_host, ldap_searches)
+        return AuthorizationContext(
+            matcher, ldap_host, ldap_searches,
+            membership_cache=current_app.ldap_membership_cache,
+            negative_cache_ttl=current_app.config['LDAP_NEGATIVE_CACHE_TTL'],
+            connection_pool=ldap_connection_pool(ldap_host))
 
-    def _create_waiver(self, args, user):
+    def _create_waiver(self, args, user, authorization=None):
         proxied_by = None
         if args.get('username'):
             if user not in current_app.config['SUPERUSERS']:
@@ -444,7 +759,10 @@ class WaiversResource(Resource):
         if not args['testcase']:
             raise BadRequest({'testcase': 'Missing required parameter in the JSON body'})
 
-        self._verify_authorization(user, args['testcase'])
+        if authorization is None:
+            authorization = self._authorization_context()
+        if authorization is not None:
+            authorization.verify(user, args['testcase'])
 
         # brew-build is an alias for koji_build
         if args['subject_type'] == 'brew-build':
@@ -493,12 +811,13 @@ class WaiversNewResource(WaiversResource):
         result = self._create_waiver(args, user)
         db.session.add(result)
         db.session.commit()
+        pin_to_primary()
         return result, 201
 
 
 class WaiverResource(Resource):
     @jsonp
-    @marshal_with(waiver_fields)
+    @use_replica
     def get(self, waiver_id):
         """
         Get a single waiver by waiver ID.
@@ -506,17 +825,91 @@ class WaiverResource(Resource):
         :param int waiver_id: The waiver's database ID.
 
         :statuscode 200: The waiver was found and returned.
+        :statuscode 304: The waiver has not changed since the response
+            identified by the ``If-None-Match`` or ``If-Modified-Since`` header.
         :statuscode 404: No waiver exists with that ID.
         """
-        try:
-            return Waiver.query.get_or_404(waiver_id)
-        except Exception as NotFound:
-            raise type(NotFound)('Waiver not found')
+        waiver = _waivers_query().filter(Waiver.id == waiver_id).first()
+        if waiver is None:
+            raise NotFound('Waiver not found')
+        etag = make_etag(__version__, waiver.id, request.full_path)
+        not_modified = conditional_get(etag, waiver.timestamp)
+        if not_modified is not None:
+            return not_modified
+        return serialize_waiver(waiver)
+
+
+class WaiversByIdsResource(Resource):
+    @use_replica
+    def post(self):
+        """
+        Get multiple waivers by waiver IDs in a single request.
+
+        **Sample request**:
+
+        .. sourcecode:: http
+
+           POST /api/v1.0/waivers/+by-ids HTTP/1.1
+           Accept: application/json
+           Content-Type: application/json
+
+           {
+                "ids": [15, 9000]
+           }
+
+        **Sample response**:
+
+        .. sourcecode:: none
+
+           HTTP/1.1 200 OK
+           Content-Type: application/json
+
+           {
+                "data": [
+                    {
+                        "id": 15,
+                        "comment": "The tests broke",
+                        "product_version": "fedora-27",
+                        "subject_type": "compose",
+                        "subject_identifier": "Fedora-9000-19700101.n.18",
+                        "testcase": "compose.install_no_user",
+                        "scenario": null,
+                        "timestamp": "2017-03-16T17:42:04.209638",
+                        "username": "jcline",
+                        "waived": true,
+                        "proxied_by": null
+                    },
+                    null
+                ],
+                "missing": [9000]
+           }
+
+        :json list ids: List of waiver IDs. The number of IDs is limited by
+            ``MAX_FILTER_VALUES`` option (100 by default).
+        :json list fields: List of waiver fields to return. By default, all
+            fields are returned.
+        :statuscode 200: Returns the waivers in the same order as the
+            requested IDs, with null in place of each waiver that does not
+            exist. IDs of such waivers are listed in ``missing``.
+        :statuscode 400: The request was malformed.
+        """
+        args = RP['get_waivers_by_ids'].parse_args()
+        ids = args['ids']
+        max_values = current_app.config['MAX_FILTER_VALUES']
+        if len(ids) > max_values:
+            raise BadRequest({'ids': 'Too many values, at most %d are allowed' % max_values})
+
+        query = _waivers_query(args['fields']).filter(Waiver.id.in_(set(ids)))
+        waivers = {waiver.id: serialize_waiver(waiver, args['fields']) for waiver in query}
+        return {
+            'data': [waivers.get(id_) for id_ in ids],
+            'missing': [id_ for id_ in ids if id_ not in waivers],
+        }
 
 
 class FilteredWaiversResource(Resource):
 
-    @marshal_with(waiver_fields, envelope='data')
+    @use_replica
     def post(self):
         """
         Get waiver records, filtered by some criteria.
@@ -582,48 +975,51 @@ class FilteredWaiversResource(Resource):
             within the filter dict are the same as the filtering
             parameters accepted by :http:get:`/api/v1.0/waivers/`.
         :json boolean include_obsolete: If true, obsolete waivers will be included.
+        :json boolean stream: If true, the waivers are fetched from the
+            database in batches and the response is streamed, which keeps
+            memory usage bounded for large results.
+        :json list fields: List of waiver fields to return. Only the columns
+            needed for these fields are fetched from the database. By default,
+            all fields are returned.
         :statuscode 200: Returns matching waivers, if any.
         :statuscode 400: The request was malformed (invalid filter critera).
         """
         args = RP['filter_waivers'].parse_args()
-        query = Waiver.query.order_by(Waiver.timestamp.desc())
-        clauses = []
-        for filter_ in args['filters']:
-            inner_clauses = []
-            if 'subject_type' in filter_:
-                inner_clauses.append(Waiver.subject_type == filter_['subject_type'])
-            if 'subject_identifier' in filter_:
-                inner_clauses.append(Waiver.subject_identifier == filter_['subject_identifier'])
-            if 'testcase' in filter_:
-                inner_clauses.append(Waiver.testcase == filter_['testcase'])
-            if 'scenario' in filter_:
-                inner_clauses.append(Waiver.scenario == filter_['scenario'])
-            if 'product_version' in filter_:
-                inner_clauses.append(Waiver.product_version == filter_['product_version'])
-            if 'username' in filter_:
-                inner_clauses.append(Waiver.username == filter_['username'])
-            if 'proxied_by' in filter_:
-                inner_clauses.append(Waiver.proxied_by == filter_['proxied_by'])
-            if 'since' in filter_:
-                try:
-                    since_start, since_end = reqparse_since(filter_['since'])
-                except ValueError as e:
-                    raise BadRequest({'since': str(e)})
-                if since_start:
-                    inner_clauses.append(Waiver.timestamp >= since_start)
-                if since_end:
-                    inner_clauses.append(Waiver.timestamp <= since_end)
-            clauses.append(and_(*inner_clauses))
-        query = query.filter(or_(*clauses))
-        if not args['include_obsolete']:
-            subquery = db.session.query(func.max(Waiver.id))\
-                .group_by(Waiver.subject_type, Waiver.subject_identifier, Waiver.testcase)
-            query = query.filter(Waiver.id.in_(subquery))
-        return query.all()
+
+        cache = None if args['stream'] else current_app.filtered_waivers_cache
+        if cache is not None:
+            # The version must be read before querying the database so that
+            # a response is not cached under a version newer than its data.
+            version = cache.version()
+            if version is None:
+                # The cache is unavailable.
+                monitor.filtered_waivers_cache_counter.labels(result='error').inc()
+                cache = None
+            else:
+                filters = sorted(json.dumps(f, sort_keys=True) for f in args['filters'])
+                cache_key = make_cache_key(
+                    version, filters, args['include_obsolete'], args['fields'])
+                response = cache.get(cache_key)
+                if response is not None:
+                    monitor.filtered_waivers_cache_counter.labels(result='hit').inc()
+                    return response
+                monitor.filtered_waivers_cache_counter.labels(result='miss').inc()
+
+        query = _filtered_waivers_query(
+            args['filters'], args['include_obsolete'], args['fields'])
+        if args['stream']:
+            return json_stream_collection(query, fields=args['fields'])
+        response = {'data': [serialize_waiver(waiver, args['fields']) for waiver in query.all()]}
+        # Replicas can lag behind, so a response read from a replica could
+        # be cached under a version which already includes newer waivers.
+        if cache is not None and g.get('db_replica') is None:
+            cache.set(cache_key, response)
+        return response
 
 
 class GetWaiversBySubjectsAndTestcases(Resource):
     @jsonp
+    @use_replica
     def post(self):
         """
         **Deprecated.** Use :http:post:`/api/v1.0/waivers/+filtered` instead.
@@ -671,7 +1067,7 @@ class GetWaiversBySubjectsAndTestcases(Resource):
            }
         """
         args = RP['get_waivers_by_subjects_and_testcase'].parse_args()
-        query = Waiver.query.order_by(Waiver.timestamp.desc())
+        query = _waivers_query(args['fields'])
         if args['results']:
             query = Waiver.by_results(query, args['results'])
         if args['product_version']:
@@ -689,8 +1085,10 @@ class GetWaiversBySubjectsAndTestcases(Resource):
         if not args['include_obsolete']:
             query = _filter_out_obsolete_waivers(query)
 
-        query = query.order_by(Waiver.timestamp.desc())
-        return {'data': marshal(query.all(), waiver_fields)}
+        query = query.order_by(*WAIVER_ORDER)
+        if args['stream']:
+            return json_stream_collection(query, fields=args['fields'])
+        return {'data': [serialize_waiver(waiver, args['fields']) for waiver in query.all()]}
 
 
 class AboutResource(Resource):
@@ -750,11 +1148,17 @@ class ConfigResource(Resource):
           }
 
         :statuscode 200: Configuration is returned.
+        :statuscode 304: The configuration has not changed since the response
+            identified by the ``If-None-Match`` header.
         """
-        return {
+        result = {
             'permission_mapping': current_app.config.get('PERMISSION_MAPPING'),
             'superusers': current_app.config.get('SUPERUSERS'),
         }
+        not_modified = conditional_get(make_etag(__version__, result, request.full_path))
+        if not_modified is not None:
+            return not_modified
+        return result
 
 
 class PermissionsResource(Resource):
@@ -792,11 +1196,18 @@ class PermissionsResource(Resource):
 
         :json string testcase: If specified, only permissions for given test case is returned.
         :statuscode 200: Permissions are returned.
+        :statuscode 304: The permissions have not changed since the response
+            identified by the ``If-None-Match`` header.
         """
         args = RP['get_permissions'].parse_args()
+        etag = make_etag(__version__, permissions(), request.full_path)
+        not_modified = conditional_get(etag)
+        if not_modified is not None:
+            return not_modified
+
         testcase = args['testcase']
         if testcase:
-            return list(match_testcase_permissions(testcase, permissions()))
+            return list(match_testcase_permissions(testcase, permission_matcher()))
 
         return permissions()
 
@@ -811,6 +1222,7 @@ class MonitorResource(Resource):
 api.add_resource(WaiversResource, '/waivers/')
 api.add_resource(WaiversNewResource, '/waivers/new')
 api.add_resource(WaiverResource, '/waivers/<int:waiver_id>')
+api.add_resource(WaiversByIdsResource, '/waivers/+by-ids')
 api.add_resource(FilteredWaiversResource, '/waivers/+filtered')
 api.add_resource(GetWaiversBySubjectsAndTestcases, '/waivers/+by-subjects-and-testcases')
 api.add_resource(AboutResource, '/about', strict_slashes=False)
@@ -14,13 +14,26 @@ from sqlalchemy import event
 from sqlalchemy.exc import ProgrammingError
 import requests
 
-from waiverdb.events import publish_new_waiver
+from waiverdb.cache import create_cache, create_ldap_membership_cache
+from waiverdb.events import (
+    add_outbox_message,
+    forget_new_waivers,
+    invalidate_waivers_cache,
+    publish_new_waiver,
+    track_new_waivers,
+)
 from waiverdb.logger import init_logging
 from waiverdb.api_v1 import api_v1, oidc
-from waiverdb.models import db
+from waiverdb.models import db, Waiver
+from waiverdb.replicas import create_replica_selector, replica_binds
+from waiverdb.tokens import create_token_validator
 from waiverdb.utils import auth_methods, json_error
 from werkzeug.exceptions import default_exceptions
-from waiverdb.monitor import db_hook_event_listeners
+from waiverdb.monitor import (
+    db_hook_event_listeners,
+    InstrumentedNullPool,
+    InstrumentedQueuePool,
+)
 
 
 def enable_cors(app):
@@ -64,11 +77,9 @@ def load_config(app):
         app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
 
 
-def populate_db_config(app):
-    # Take the application-level DATABASE_URI setting, plus (optionally)
-    # a DATABASE_PASSWORD from the environment, and munge them together into
-    # the SQLALCHEMY_DATABASE_URI setting which is obeyed by Flask-SQLAlchemy.
-    dburi = app.config['DATABASE_URI']
+def _database_uri_with_password(dburi):
+    # Munge (optionally) a DATABASE_PASSWORD from the environment into the
+    # database URI.
     if os.environ.get('DATABASE_PASSWORD'):
         parsed = urlparse(dburi)
         netloc = '{}:{}@{}'.format(parsed.username,
@@ -78,10 +89,51 @@ def populate_db_config(app):
             netloc += ':{}'.format(parsed.port)
         dburi = urlunsplit(
             (parsed.scheme, netloc, parsed.path, parsed.query, parsed.fragment))
+    return dburi
+
+
+def _pool_options(config, dburi):
+    # SQLite (used for development and tests) keeps Flask-SQLAlchemy defaults.
+    if dburi.startswith('sqlite'):
+        return {}
+
+    if config['DATABASE_NULL_POOL']:
+        return {
+            'poolclass': InstrumentedNullPool,
+            'pool_pre_ping': config['DATABASE_POOL_PRE_PING'],
+        }
+
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config['DATABASE_POOL_SIZE'],
+        'max_overflow': config['DATABASE_MAX_OVERFLOW'],
+        'pool_timeout': config['DATABASE_POOL_TIMEOUT'],
+        'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+        'pool_pre_ping': config['DATABASE_POOL_PRE_PING'],
+    }
+
+
+def populate_db_config(app):
+    # Take the application-level DATABASE_URI setting, plus (optionally)
+    # a DATABASE_PASSWORD from the environment, and munge them together into
+    # the SQLALCHEMY_DATABASE_URI setting which is obeyed by Flask-SQLAlchemy.
+    dburi = _database_uri_with_password(app.config['DATABASE_URI'])
     if app.config['SHOW_DB_URI']:
         app.logger.debug('using DBURI: %s', dburi)
     app.config['SQLALCHEMY_DATABASE_URI'] = dburi
 
+    engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    engine_options.update(_pool_options(app.config, dburi))
+
+    # Read replicas are configured as additional binds.
+    replica_uris = [
+        _database_uri_with_password(uri)
+        for uri in app.config.get('REPLICA_DATABASE_URIS') or []
+    ]
+    if replica_uris:
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        binds.update(replica_binds(replica_uris))
+
 
 # applicaiton factory http://flask.pocoo.org/docs/0.12/patterns/appfactories/
 def create_app(config_obj=None):
@@ -100,9 +152,17 @@ def create_app(config_obj=None):
     app.register_error_handler(requests.Timeout, json_error)
 
     populate_db_config(app)
+    app.filtered_waivers_cache = create_cache(app.config)
+    app.ldap_membership_cache = create_ldap_membership_cache(app.config)
+    # LDAP connection pools by LDAP_HOST, created on first use
+    app.ldap_connection_pools = {}
+    # Compiled PERMISSIONS, created on first use
+    app.permission_matcher = None
+    app.replica_selector = create_replica_selector(app.config)
     if 'OIDC' in auth_methods(app):
         oidc.init_app(app)
         app.oidc = oidc
+        app.oidc_token_validator = create_token_validator(app.config, oidc)
     # initialize logging
     init_logging(app)
     # initialize db
@@ -119,13 +179,19 @@ def create_app(config_obj=None):
     register_event_handlers(app)
 
     # initialize DB event listeners from the monitor module
-    app.before_first_request(db_hook_event_listeners)
+    app.before_first_request(register_db_event_listeners)
 
     enable_cors(app)
 
     return app
 
 
+def register_db_event_listeners():
+    # Instrument the primary database and all replicas.
+    for engine in db.engines.values():
+        db_hook_event_listeners(engine)
+
+
 def healthcheck():
     """
     Request handler for performing an application-level health check. This is
@@ -159,12 +225,24 @@ def register_event_handlers(app):
         app (flask.Flask): The Flask object with the configured scoped session
             attached as the ``session`` attribute.
     """
-    if app.config['MESSAGE_BUS_PUBLISH']:
-        # A workaround for https://github.com/mitsuhiko/flask-sqlalchemy/pull/364
-        # can be removed after python-flask-sqlalchemy is upgraded to 2.2
-        from flask_sqlalchemy import SignallingSession
+    # A workaround for https://github.com/mitsuhiko/flask-sqlalchemy/pull/364
+    # can be removed after python-flask-sqlalchemy is upgraded to 2.2
+    from flask_sqlalchemy import SignallingSession
+
+    # New waivers are collected on flush so that the after_commit hooks below
+    # process only these; the collection is dropped by the last hook.
+    event.listen(SignallingSession, 'after_flush', track_new_waivers)
+    event.listen(SignallingSession, 'after_rollback', forget_new_waivers)
+    event.listen(SignallingSession, 'after_commit', invalidate_waivers_cache)
+
+    if app.config['MESSAGE_BUS_PUBLISH'] and app.config['MESSAGE_OUTBOX']:
+        # Messages are published by "waiverdb dispatch-messages"
+        event.listen(Waiver, 'after_insert', add_outbox_message)
+    elif app.config['MESSAGE_BUS_PUBLISH']:
         event.listen(SignallingSession, 'after_commit', publish_new_waiver)
 
+    event.listen(SignallingSession, 'after_commit', forget_new_waivers)
+
 
 def favicon():
     return send_from_directory(
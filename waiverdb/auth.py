@@ -72,9 +72,7 @@ def get_user_by_method(request, auth_method):
             'openid',
             current_app.config['OIDC_REQUIRED_SCOPE'],
         ]
-        validity = current_app.oidc.validate_token(token, required_scopes)
-        if validity is not True:
-            raise Unauthorized(validity)
+        g.oidc_token_info = current_app.oidc_token_validator.validate(token, required_scopes)
         user = g.oidc_token_info['username']
     elif auth_method == 'Kerberos':
         if 'Authorization' not in request.headers:
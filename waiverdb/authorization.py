@@ -1,8 +1,14 @@
 # SPDX-License-Identifier: GPL-2.0+
 
+import contextlib
+import functools
+import itertools
 import logging
+import os
 import re
-from fnmatch import fnmatch
+import threading
+import time
+from fnmatch import fnmatch, translate as fnmatch_translate
 
 from werkzeug.exceptions import (
     BadGateway,
@@ -10,6 +16,8 @@ from werkzeug.exceptions import (
     Unauthorized,
 )
 
+import waiverdb.monitor as monitor
+
 log = logging.getLogger(__name__)
 
 
@@ -26,12 +34,231 @@ def get_group_membership(ldap, user, con, ldap_search):
     except ldap.SERVER_DOWN:
         log.exception('The LDAP server is not reachable.')
         raise BadGateway('The LDAP server is not reachable.')
+    except ldap.TIMEOUT:
+        log.exception('The LDAP server did not respond in time.')
+        raise BadGateway('The LDAP server did not respond in time.')
+    except ldap.LDAPError:
+        log.exception('Some error occurred initializing the LDAP connection.')
+        raise Unauthorized('Some error occurred initializing the LDAP connection.')
+
+
+def _ldap_initialize(ldap, ldap_host):
+    try:
+        return ldap.initialize(ldap_host)
     except ldap.LDAPError:
         log.exception('Some error occurred initializing the LDAP connection.')
         raise Unauthorized('Some error occurred initializing the LDAP connection.')
 
 
+class LdapConnectionPool(object):
+    """
+    Per-process pool of LDAP connections to a single server.
+
+    Connections are reused between requests. A connection which was idle for
+    more than ``idle_check`` seconds is checked with a "Who am I?" operation
+    before it is reused.
+
+    After ``failure_threshold`` consecutive failures to reach the server, the
+    pool fails fast with :class:`BadGateway` for ``retry_delay`` seconds
+    instead of waiting for the server again.
+    """
+    def __init__(self, ldap_host, max_size=4, network_timeout=5, timeout=10,
+                 failure_threshold=3, retry_delay=30, idle_check=60):
+        self.ldap_host = ldap_host
+        self.max_size = max_size
+        self.network_timeout = network_timeout
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.retry_delay = retry_delay
+        self.idle_check = idle_check
+        self._lock = threading.Lock()
+        self._idle = []
+        self._failures = 0
+        self._open_until = 0
+
+    def _connect(self, ldap):
+        con = _ldap_initialize(ldap, self.ldap_host)
+        con.set_option(ldap.OPT_NETWORK_TIMEOUT, self.network_timeout)
+        con.set_option(ldap.OPT_TIMEOUT, self.timeout)
+        monitor.ldap_connect_counter.inc()
+        return con
+
+    def _is_healthy(self, ldap, con):
+        try:
+            con.whoami_s()
+        except ldap.LDAPError:
+            log.warning('Discarding broken LDAP connection to %s', self.ldap_host)
+            return False
+        return True
+
+    def _acquire(self, ldap):
+        now = time.monotonic()
+        with self._lock:
+            if self._open_until > now:
+                monitor.ldap_circuit_open_counter.inc()
+                raise BadGateway('The LDAP server is not reachable.')
+            idle = self._idle.pop() if self._idle else None
+
+        while idle is not None:
+            con, released = idle
+            if now - released < self.idle_check or self._is_healthy(ldap, con):
+                return con
+            self._close(con)
+            with self._lock:
+                idle = self._idle.pop() if self._idle else None
+
+        return self._connect(ldap)
+
+    def _release(self, con):
+        with self._lock:
+            self._failures = 0
+            if len(self._idle) < self.max_size:
+                self._idle.append((con, time.monotonic()))
+                return
+        self._close(con)
+
+    def _record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                log.error('LDAP server %s is not reachable, failing fast for %s seconds',
+                          self.ldap_host, self.retry_delay)
+                self._open_until = time.monotonic() + self.retry_delay
+                self._failures = 0
+
+    def _close(self, con):
+        try:
+            con.unbind_s()
+        except Exception:
+            log.debug('Failed to unbind LDAP connection', exc_info=True)
+
+    @contextlib.contextmanager
+    def connection(self, ldap):
+        """
+        Context manager which provides a connection from the pool.
+
+        The connection is returned to the pool unless the LDAP server could
+        not be reached, in which case it is closed and the failure counts
+        towards opening the circuit breaker.
+        """
+        con = self._acquire(ldap)
+        try:
+            yield con
+        except BadGateway:
+            self._record_failure()
+            self._close(con)
+            raise
+        except Exception:
+            self._close(con)
+            raise
+        else:
+            self._release(con)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for con, _ in idle:
+            self._close(con)
+
+
+@contextlib.contextmanager
+def _ldap_connection(ldap, ldap_host, connection_pool):
+    if connection_pool is not None:
+        with connection_pool.connection(ldap) as con:
+            yield con
+    else:
+        yield _ldap_initialize(ldap, ldap_host)
+
+
+GLOB_SPECIAL_CHARS = '*?['
+
+
+def _glob_literal_prefix(pattern):
+    """
+    Returns the part of a glob pattern before the first special character.
+    """
+    for i, char in enumerate(pattern):
+        if char in GLOB_SPECIAL_CHARS:
+            return pattern[:i]
+    return pattern
+
+
+class PermissionMatcher(object):
+    """
+    Index of PERMISSIONS for fast lookup of permissions matching a test case.
+
+    Glob patterns from ``testcases`` are compiled and stored in a trie by
+    their literal prefix, so only patterns whose prefix matches the test case
+    are tried. Legacy ``_testcase_regex_pattern`` entries are first checked
+    with a single combined regular expression. Results are memoized for the
+    most recent ``cache_size`` test cases.
+
+    :meth:`match` returns the same permissions, in the same order, as
+    :func:`match_testcase_permissions`.
+    """
+    def __init__(self, permissions, cache_size=1024):
+        self.permissions = permissions
+        self._trie = {}
+        self._regexes = []
+        for index, permission in enumerate(permissions):
+            if "testcases" in permission:
+                for testcase_pattern in permission["testcases"]:
+                    self._add_glob(index, testcase_pattern)
+            elif "_testcase_regex_pattern" in permission:
+                self._regexes.append(
+                    (index, re.compile(permission["_testcase_regex_pattern"])))
+        self._combined_regex = self._combine_regexes()
+        self.match = functools.lru_cache(maxsize=cache_size)(self._match)
+
+    def _add_glob(self, index, testcase_pattern):
+        # Same normalization as fnmatch()
+        pattern = os.path.normcase(testcase_pattern)
+        node = self._trie
+        for char in _glob_literal_prefix(pattern):
+            node = node.setdefault(char, {})
+        node.setdefault(None, []).append((index, re.compile(fnmatch_translate(pattern))))
+
+    def _combine_regexes(self):
+        # Combining patterns with groups could change meaning of backreferences.
+        if not self._regexes or any(regex.groups for _, regex in self._regexes):
+            return None
+        try:
+            return re.compile('|'.join('(?:%s)' % regex.pattern for _, regex in self._regexes))
+        except re.error:
+            # For example, patterns with global flags
+            return None
+
+    def _glob_matches(self, testcase):
+        name = os.path.normcase(testcase)
+        node = self._trie
+        for char in itertools.chain(name, [None]):
+            for index, regex in node.get(None, ()):
+                if regex.match(name):
+                    yield index
+            if char is None:
+                break
+            node = node.get(char)
+            if node is None:
+                break
+
+    def _regex_matches(self, testcase):
+        if self._combined_regex is not None and not self._combined_regex.search(testcase):
+            return
+        for index, regex in self._regexes:
+            if regex.search(testcase):
+                yield index
+
+    def _match(self, testcase):
+        indexes = set(self._glob_matches(testcase))
+        indexes.update(self._regex_matches(testcase))
+        return tuple(self.permissions[index] for index in sorted(indexes))
+
+
 def match_testcase_permissions(testcase, permissions):
+    if isinstance(permissions, PermissionMatcher):
+        yield from permissions.match(testcase)
+        return
+
     for permission in permissions:
         if "testcases" in permission:
             testcase_match = any(
@@ -48,39 +275,133 @@ def match_testcase_permissions(testcase, permissions):
             yield permission
 
 
-def verify_authorization(user, testcase, permissions, ldap_host, ldap_searches):
-    if not (ldap_host and ldap_searches):
-        raise InternalServerError(('LDAP_HOST and LDAP_SEARCHES also need to be defined '
-                                   'if PERMISSIONS is defined.'))
+class AuthorizationContext(object):
+    """
+    Verifies that users are allowed to waive test cases, remembering the
+    results, so that a request creating many waivers checks each distinct
+    user and test case only once.
+
+    LDAP group membership of each user is fetched only once and shared by
+    checks for all test cases. Searches from ``ldap_searches`` are run in
+    order and only until one of them finds an allowed group.
+
+    See :func:`verify_authorization` for description of the arguments.
+    """
+    def __init__(self, permissions, ldap_host, ldap_searches,
+                 membership_cache=None, negative_cache_ttl=None,
+                 connection_pool=None):
+        self.permissions = permissions
+        self.ldap_host = ldap_host
+        self.ldap_searches = ldap_searches
+        self.membership_cache = membership_cache
+        self.negative_cache_ttl = negative_cache_ttl
+        self.connection_pool = connection_pool
+        self._authorized = set()
+        # user -> (set of groups, number of LDAP searches done)
+        self._group_membership = {}
 
-    allowed_groups = []
-    for permission in match_testcase_permissions(testcase, permissions):
-        if user in permission.get('users', []):
+    def verify(self, user, testcase):
+        """
+        Raises an HTTP exception unless the user is allowed to waive the test
+        case, either directly or by membership in one of the allowed LDAP
+        groups.
+        """
+        if (user, testcase) in self._authorized:
             return True
-        allowed_groups += permission.get('groups', [])
 
-    try:
-        import ldap
-    except ImportError:
-        raise InternalServerError(('If PERMISSIONS is defined, '
-                                   'python-ldap needs to be installed.'))
+        if not (self.ldap_host and self.ldap_searches):
+            raise InternalServerError(('LDAP_HOST and LDAP_SEARCHES also need to be defined '
+                                       'if PERMISSIONS is defined.'))
 
-    try:
-        con = ldap.initialize(ldap_host)
-    except ldap.LDAPError:
-        log.exception('Some error occurred initializing the LDAP connection.')
-        raise Unauthorized('Some error occurred initializing the LDAP connection.')
-    group_membership = set()
+        allowed_groups = set()
+        for permission in match_testcase_permissions(testcase, self.permissions):
+            if user in permission.get('users', []):
+                self._authorized.add((user, testcase))
+                return True
+            allowed_groups.update(permission.get('groups', []))
 
-    for cur_ldap_search in ldap_searches:
-        group_membership.update(
-            get_group_membership(ldap, user, con, cur_ldap_search)
-        )
-        if group_membership & set(allowed_groups):
+        group_membership = self._fetch_group_membership(user, allowed_groups)
+        if group_membership & allowed_groups:
+            self._authorized.add((user, testcase))
             return True
 
-    if not group_membership:
-        raise Unauthorized(f'Couldn\'t find user {user} in LDAP')
+        if not group_membership:
+            raise Unauthorized(f'Couldn\'t find user {user} in LDAP')
+
+        raise Unauthorized(('You are not authorized to submit a waiver '
+                            f'for the test case {testcase}'))
+
+    def _fetch_group_membership(self, user, allowed_groups):
+        """
+        Returns groups of the user found so far, running the remaining LDAP
+        searches only until an allowed group is found.
+        """
+        group_membership, searched = self._group_membership.get(user, (set(), 0))
+        if group_membership & allowed_groups or searched == len(self.ldap_searches):
+            return group_membership
+
+        try:
+            import ldap
+        except ImportError:
+            raise InternalServerError(('If PERMISSIONS is defined, '
+                                       'python-ldap needs to be installed.'))
+
+        con = None
+        with contextlib.ExitStack() as stack:
+            for cur_ldap_search in self.ldap_searches[searched:]:
+                cache_key = (
+                    self.ldap_host,
+                    user,
+                    cur_ldap_search.get('BASE'),
+                    cur_ldap_search.get('SEARCH_STRING'),
+                )
+                groups = None
+                if self.membership_cache is not None:
+                    groups = self.membership_cache.get(cache_key)
+                    result = 'miss' if groups is None else 'hit'
+                    monitor.ldap_membership_cache_counter.labels(result=result).inc()
+
+                if groups is None:
+                    if con is None:
+                        con = stack.enter_context(
+                            _ldap_connection(ldap, self.ldap_host, self.connection_pool))
+                    start = time.monotonic()
+                    groups = tuple(get_group_membership(ldap, user, con, cur_ldap_search))
+                    monitor.ldap_search_duration_histogram.observe(time.monotonic() - start)
+                    if self.membership_cache is not None:
+                        ttl = None if groups else self.negative_cache_ttl
+                        self.membership_cache.set(cache_key, groups, ttl=ttl)
+
+                searched += 1
+                group_membership.update(groups)
+                self._group_membership[user] = (group_membership, searched)
+                if group_membership & allowed_groups:
+                    break
+
+        return group_membership
+
+
+def verify_authorization(user, testcase, permissions, ldap_host, ldap_searches,
+                         membership_cache=None, negative_cache_ttl=None,
+                         connection_pool=None):
+    """
+    Raises an HTTP exception unless the user is allowed to waive the test
+    case, either directly or by membership in one of the allowed LDAP groups.
+
+    If ``membership_cache`` is set (see
+    :func:`waiverdb.cache.create_ldap_membership_cache`), group membership
+    from each LDAP search is cached, so repeated checks for the same user
+    do not query LDAP again. Empty results are cached for
+    ``negative_cache_ttl`` seconds.
+
+    If ``connection_pool`` (:class:`LdapConnectionPool`) is set, LDAP
+    connections are taken from it instead of opening a new one.
 
-    raise Unauthorized(('You are not authorized to submit a waiver '
-                        f'for the test case {testcase}'))
+    To verify multiple test cases, use :class:`AuthorizationContext` instead.
+    """
+    context = AuthorizationContext(
+        permissions, ldap_host, ldap_searches,
+        membership_cache=membership_cache,
+        negative_cache_ttl=negative_cache_ttl,
+        connection_pool=connection_pool)
+    return context.verify(user, testcase)
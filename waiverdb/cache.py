@@ -0,0 +1,147 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Response cache for waiver queries (and a generic bounded in-process cache).
+
+Cached entries are keyed on a version number which is increased whenever new
+waivers are committed, so stale entries are never returned after the change
+(with the in-process cache, this applies only to changes committed by the
+same process; other processes rely on the entry TTL).
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+def make_cache_key(version, *parts):
+    data = json.dumps([version, parts], sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class LocalCache(object):
+    """
+    Bounded in-process LRU cache with expiring entries.
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._version = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def version(self):
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+            # Entries for older versions can never be hit again.
+            self._entries.clear()
+
+
+class RedisCache(object):
+    """
+    Cache shared by multiple processes, stored in Redis.
+
+    Redis errors are logged and handled as cache misses, so the cache being
+    unavailable does not fail requests. If the version cannot be read,
+    :meth:`version` returns None and the cache must not be used.
+
+    Requires the redis Python package.
+    """
+    VERSION_KEY = 'waiverdb:cache:version'
+    KEY_PREFIX = 'waiverdb:cache:'
+
+    def __init__(self, url, ttl):
+        import redis
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+        self._errors = redis.exceptions.RedisError
+
+    def get(self, key):
+        try:
+            value = self._redis.get(self.KEY_PREFIX + key)
+        except self._errors:
+            log.exception('Failed to get cached response from Redis')
+            return None
+        if value is None:
+            return None
+        return json.loads(value)
+
+    def set(self, key, value):
+        try:
+            self._redis.set(self.KEY_PREFIX + key, json.dumps(value), ex=self.ttl)
+        except self._errors:
+            log.exception('Failed to cache response in Redis')
+
+    def version(self):
+        try:
+            return int(self._redis.get(self.VERSION_KEY) or 0)
+        except self._errors:
+            log.exception('Failed to get cache version from Redis')
+            return None
+
+    def bump_version(self):
+        try:
+            self._redis.incr(self.VERSION_KEY)
+        except self._errors:
+            # Other processes can return stale responses until they expire.
+            log.exception('Failed to invalidate cached responses in Redis')
+
+
+def create_ldap_membership_cache(config):
+    """
+    Returns cache for LDAP group membership based on LDAP_CACHE_* options or
+    None if the cache is disabled.
+    """
+    max_size = config['LDAP_CACHE_SIZE']
+    if max_size > 0 and config['LDAP_CACHE_TTL'] > 0:
+        return LocalCache(max_size, config['LDAP_CACHE_TTL'])
+    return None
+
+
+def create_cache(config):
+    """
+    Returns cache for POST /waivers/+filtered responses based on
+    FILTERED_WAIVERS_CACHE_* options or None if the cache is disabled.
+    """
+    ttl = config['FILTERED_WAIVERS_CACHE_TTL']
+    redis_url = config.get('FILTERED_WAIVERS_CACHE_REDIS_URL')
+    if redis_url:
+        try:
+            return RedisCache(redis_url, ttl)
+        except ImportError:
+            raise RuntimeError(('If FILTERED_WAIVERS_CACHE_REDIS_URL is defined, '
+                                'redis needs to be installed.'))
+
+    max_size = config['FILTERED_WAIVERS_CACHE_SIZE']
+    if max_size > 0:
+        return LocalCache(max_size, ttl)
+
+    return None
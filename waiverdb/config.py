@@ -27,7 +27,81 @@ class Config(object):
     MESSAGE_BUS_PUBLISH = True
     # Specify fedmsg or stomp for publishing messages
     MESSAGE_PUBLISHER = 'fedmsg'
+    # Set this to True to store messages in the database in the same
+    # transaction as new waivers and publish them asynchronously with
+    # "waiverdb dispatch-messages" instead of publishing them after commit.
+    MESSAGE_OUTBOX = False
+    # Set this to True to publish all new waivers from a transaction at once:
+    # in a single STOMP transaction or, with fedmsg, as a single
+    # "waiverdb.waivers.new" message with a list of waivers.
+    MESSAGE_BATCH_PUBLISH = False
     SQLALCHEMY_TRACK_MODIFICATIONS = True
+    # Maximum number of cached LDAP group membership results (for each user and
+    # search in LDAP_SEARCHES) in each process; set to 0 to disable the cache.
+    LDAP_CACHE_SIZE = 1000
+    # Number of seconds the LDAP group membership is cached.
+    LDAP_CACHE_TTL = 300
+    # Number of seconds an empty LDAP group membership (user not found) is
+    # cached.
+    LDAP_NEGATIVE_CACHE_TTL = 60
+    # Maximum number of idle LDAP connections kept in each process.
+    LDAP_POOL_SIZE = 4
+    # Number of seconds to wait for connecting to the LDAP server.
+    LDAP_NETWORK_TIMEOUT = 5
+    # Number of seconds to wait for an LDAP search result.
+    LDAP_TIMEOUT = 10
+    # After this many consecutive failures to reach the LDAP server, requests
+    # needing LDAP fail immediately for LDAP_RETRY_DELAY seconds.
+    LDAP_FAILURE_THRESHOLD = 3
+    LDAP_RETRY_DELAY = 30
+    # Maximum number of validated OIDC access tokens cached in each process;
+    # set to 0 to validate each token with the identity provider.
+    OIDC_TOKEN_CACHE_SIZE = 1000
+    # Number of seconds a validated token is cached (never after it expires).
+    OIDC_TOKEN_CACHE_TTL = 300
+    # URI of the identity provider JWKS (JSON Web Key Set); if set, tokens are
+    # JWTs verified locally (requires PyJWT) instead of using the token
+    # introspection endpoint.
+    OIDC_JWKS_URI = None
+    # Number of seconds the keys from OIDC_JWKS_URI are cached.
+    OIDC_JWKS_CACHE_TTL = 300
+    OIDC_JWT_ALGORITHMS = ['RS256']
+    # Expected "iss" claim of the JWT tokens, if set.
+    OIDC_JWT_ISSUER = None
+    # Database connection pool settings, see
+    # https://docs.sqlalchemy.org/en/14/core/pooling.html
+    DATABASE_POOL_SIZE = 5
+    DATABASE_MAX_OVERFLOW = 10
+    # Number of seconds to wait for a connection from the pool.
+    DATABASE_POOL_TIMEOUT = 30
+    # Number of seconds after which connections are re-opened (-1 to never).
+    DATABASE_POOL_RECYCLE = -1
+    # Set this to True to test connections before using them from the pool.
+    DATABASE_POOL_PRE_PING = False
+    # Set this to True to open a new connection for each transaction instead
+    # of pooling them (when connecting through an external pooler like
+    # PgBouncer).
+    DATABASE_NULL_POOL = False
+    # URIs of read-only database replicas used by GET /waivers/,
+    # GET /waivers/<id>, POST /waivers/+filtered and
+    # POST /waivers/+by-subjects-and-testcases.
+    REPLICA_DATABASE_URIS = []
+    # Number of seconds to skip a replica after a failed query.
+    REPLICA_RETRY_DELAY = 30
+    # Number of seconds a client reads from the primary database after it
+    # created a waiver (so it can read its own writes).
+    REPLICA_READ_YOUR_WRITES = 10
+    # Maximum number of values for each filter parameter in GET /waivers/
+    # (e.g. "?testcase=a&testcase=b" or "?testcase=a,b") and of IDs in
+    # POST /waivers/+by-ids.
+    MAX_FILTER_VALUES = 100
+    # Maximum number of cached responses for POST /waivers/+filtered in each
+    # process; set to 0 to disable the cache.
+    FILTERED_WAIVERS_CACHE_SIZE = 0
+    # Number of seconds the cached responses are valid.
+    FILTERED_WAIVERS_CACHE_TTL = 60
+    # Redis URL to use a cache shared by all processes instead.
+    FILTERED_WAIVERS_CACHE_REDIS_URL = None
     # A list of users are allowed to create waivers on behalf of other users.
     SUPERUSERS = []
     PERMISSIONS = []
@@ -67,5 +141,9 @@ class TestingConfig(Config):
     OIDC_REQUIRED_SCOPE = 'waiverdb_scope'
     OIDC_RESOURCE_SERVER_ONLY = True
     SUPERUSERS = ['bodhi']
+    # Tests mock different LDAP responses for the same user.
+    LDAP_CACHE_SIZE = 0
+    # Tests mock different token introspection responses for the same token.
+    OIDC_TOKEN_CACHE_SIZE = 0
 
     CORS_ORIGINS = 'https://bodhi.fedoraproject.org'
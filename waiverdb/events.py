@@ -9,10 +9,10 @@ using the :func:`sqlalchemy.event.listen` function.
     https://docs.sqlalchemy.org/en/latest/orm/events.html
 """
 
+import datetime
 import logging
 import time
 
-from flask_restful import marshal
 import stomp
 import json
 import waiverdb.monitor as monitor
@@ -20,48 +20,159 @@ import waiverdb.monitor as monitor
 from fedora_messaging.api import Message, publish
 from fedora_messaging.exceptions import PublishReturned, ConnectionException
 from flask import current_app
-from waiverdb.fields import waiver_fields
-from waiverdb.models import Waiver
+from waiverdb.fields import serialize_waiver
+from waiverdb.models import db, OutboxMessage, Waiver
 from waiverdb.utils import stomp_connection
 
 _log = logging.getLogger(__name__)
 
 MAX_STOMP_RETRY = 3
 STOMP_RETRY_DELAY_SECONDS = 5
+NEW_WAIVER_TOPIC = 'waiverdb.waiver.new'
+NEW_WAIVERS_BATCH_TOPIC = 'waiverdb.waivers.new'
 
 
-def _send_stomp_message(session):
+NEW_WAIVERS_SESSION_KEY = 'waiverdb_new_waivers'
+
+
+def _new_waiver_messages(waivers):
+    for waiver in waivers:
+        monitor.messaging_tx_to_send_counter.inc()
+        _log.debug('Publishing a message for %r', waiver)
+        yield serialize_waiver(waiver)
+
+
+def _send_stomp_messages(bodies):
+    # With MESSAGE_BATCH_PUBLISH, all messages are sent in a single STOMP
+    # transaction so the broker handles them at once on commit.
+    batch = current_app.config.get('MESSAGE_BATCH_PUBLISH', False)
+    if batch:
+        bodies = list(bodies)
     with stomp_connection() as conn:
         stomp_configs = current_app.config.get('STOMP_CONFIGS')
-        for row in session.identity_map.values():
-            monitor.messaging_tx_to_send_counter.inc()
-            if not isinstance(row, Waiver):
-                continue
-            _log.debug('Publishing a message for %r', row)
-            msg = json.dumps(marshal(row, waiver_fields))
+        transaction = conn.begin() if batch else None
+        for body in bodies:
+            msg = json.dumps(body)
             kwargs = dict(body=msg, headers={}, destination=stomp_configs['destination'])
+            if transaction is not None:
+                kwargs['transaction'] = transaction
             if stomp.__version__[0] < 4:
                 kwargs['message'] = kwargs.pop('body')  # On EL7, different sig.
             try:
                 conn.send(**kwargs)
-                monitor.messaging_tx_sent_ok_counter.inc()
             except Exception:
                 _log.exception('Couldn\'t publish message via stomp')
-                monitor.messaging_tx_failed_counter.inc()
+                if transaction is None:
+                    monitor.messaging_tx_failed_counter.inc()
+                else:
+                    # None of the messages in the transaction are delivered.
+                    monitor.messaging_tx_failed_counter.inc(len(bodies))
+                    try:
+                        conn.abort(transaction)
+                    except Exception:
+                        _log.exception('Couldn\'t abort stomp transaction')
+                raise
+            if transaction is None:
+                monitor.messaging_tx_sent_ok_counter.inc()
+
+        if transaction is not None:
+            try:
+                conn.commit(transaction)
+            except Exception:
+                _log.exception('Couldn\'t commit stomp transaction')
+                monitor.messaging_tx_failed_counter.inc(len(bodies))
                 raise
+            monitor.messaging_tx_sent_ok_counter.inc(len(bodies))
+
+
+def _send_stomp_message(waivers):
+    _send_stomp_messages(_new_waiver_messages(waivers))
+
+
+def _publish_fedmsg(topic, body, count=1):
+    try:
+        msg = Message(topic=topic, body=body)
+        publish(msg)
+        monitor.messaging_tx_sent_ok_counter.inc(count)
+    except PublishReturned as e:
+        _log.exception('Fedora Messaging broker rejected message %s: %s', msg.id, e)
+        monitor.messaging_tx_failed_counter.inc(count)
+    except ConnectionException as e:
+        _log.exception('Error sending message %s: %s', msg.id, e)
+        monitor.messaging_tx_failed_counter.inc(count)
+        raise
+
+
+def _send_fedmsg_messages(bodies):
+    # With MESSAGE_BATCH_PUBLISH, a single message containing all the waivers
+    # is published instead of a message per waiver.
+    if current_app.config.get('MESSAGE_BATCH_PUBLISH', False):
+        bodies = list(bodies)
+        if bodies:
+            _publish_fedmsg(NEW_WAIVERS_BATCH_TOPIC, {'waivers': bodies}, len(bodies))
+        return
 
+    for body in bodies:
+        _publish_fedmsg(NEW_WAIVER_TOPIC, body)
 
-def _send_stomp_message_with_retry(session, max_retry, retry_delay):
+
+def _send_stomp_message_with_retry(waivers, max_retry, retry_delay):
     for i in range(max_retry):
         time.sleep(i * retry_delay)
         try:
-            _send_stomp_message(session)
+            _send_stomp_message(waivers)
         except stomp.exception.StompException:
             _log.exception('Failed to send message (try %s/%s)', i + 1, max_retry)
         else:
             break
 
 
+def track_new_waivers(session, flush_context):
+    """
+    A post-flush event hook that collects waivers inserted in the session, so
+    that :func:`publish_new_waiver` publishes only these after commit.
+
+    This event is designed to be registered with a session factory together
+    with :func:`forget_new_waivers` and :func:`publish_new_waiver`::
+
+        >>> from sqlalchemy.event import listen
+        >>> listen(MyScopedSession, 'after_flush', track_new_waivers)
+        >>> listen(MyScopedSession, 'after_rollback', forget_new_waivers)
+
+    Args:
+        session (sqlalchemy.orm.Session): The session that was flushed.
+        flush_context (sqlalchemy.orm.session.UOWTransaction): Unused.
+    """
+    new_waivers = [row for row in session.new if isinstance(row, Waiver)]
+    if new_waivers:
+        session.info.setdefault(NEW_WAIVERS_SESSION_KEY, []).extend(new_waivers)
+
+
+def forget_new_waivers(session):
+    """
+    A post-rollback and post-commit event hook that drops waivers collected by
+    :func:`track_new_waivers`.
+
+    Args:
+        session (sqlalchemy.orm.Session): The session that was rolled back or
+            committed.
+    """
+    session.info.pop(NEW_WAIVERS_SESSION_KEY, None)
+
+
+def invalidate_waivers_cache(session):
+    """
+    A post-commit event hook that invalidates cached waiver query responses
+    if new waivers were committed.
+
+    Args:
+        session (sqlalchemy.orm.Session): The session that was committed.
+    """
+    cache = getattr(current_app, 'filtered_waivers_cache', None)
+    if cache is not None and session.info.get(NEW_WAIVERS_SESSION_KEY):
+        cache.bump_version()
+
+
 def publish_new_waiver(session):
     """
     A post-commit event hook that emits messages to a message bus. The messages
@@ -93,39 +204,28 @@ def publish_new_waiver(session):
           }
         }
 
+    Only waivers collected by :func:`track_new_waivers` since the last commit
+    are published.
+
     Args:
         session (sqlalchemy.orm.Session): The session that was committed to the
             database. This session is not active and cannot emit SQL.
 
     """
+    waivers = session.info.pop(NEW_WAIVERS_SESSION_KEY, None)
+    if not waivers:
+        return
+
     _log.debug('The publish_new_waiver SQLAlchemy event has been activated (%r)',
                current_app.config['MESSAGE_PUBLISHER'])
 
     if current_app.config['MESSAGE_PUBLISHER'] == 'stomp':
         max_retry = current_app.config.get('MAX_STOMP_RETRY', MAX_STOMP_RETRY)
         retry_delay = current_app.config.get('STOMP_RETRY_DELAY_SECONDS', STOMP_RETRY_DELAY_SECONDS)
-        _send_stomp_message_with_retry(session, max_retry=max_retry, retry_delay=retry_delay)
+        _send_stomp_message_with_retry(waivers, max_retry=max_retry, retry_delay=retry_delay)
 
     elif current_app.config['MESSAGE_PUBLISHER'] == 'fedmsg':
-        for row in session.identity_map.values():
-            monitor.messaging_tx_to_send_counter.inc()
-            if not isinstance(row, Waiver):
-                continue
-            _log.debug('Publishing a message for %r', row)
-            try:
-                msg = Message(
-                    topic='waiverdb.waiver.new',
-                    body=marshal(row, waiver_fields)
-                )
-                publish(msg)
-                monitor.messaging_tx_sent_ok_counter.inc()
-            except PublishReturned as e:
-                _log.exception('Fedora Messaging broker rejected message %s: %s', msg.id, e)
-                monitor.messaging_tx_failed_counter.inc()
-            except ConnectionException as e:
-                _log.exception('Error sending message %s: %s', msg.id, e)
-                monitor.messaging_tx_failed_counter.inc()
-                raise
+        _send_fedmsg_messages(_new_waiver_messages(waivers))
 
     elif current_app.config['MESSAGE_PUBLISHER'] is None:
         _log.info('No message published.  MESSAGE_PUBLISHER disabled.')
@@ -134,3 +234,72 @@ def publish_new_waiver(session):
     else:
         _log.warning('Unhandled MESSAGE_PUBLISHER %r', current_app.config['MESSAGE_PUBLISHER'])
         monitor.messaging_tx_failed_counter.inc()
+
+
+def add_outbox_message(mapper, connection, target):
+    """
+    A mapper event hook that stores a message about a newly inserted waiver
+    in the outbox, in the same transaction as the waiver itself.
+
+    This event is designed to be registered with the Waiver model instead of
+    :func:`publish_new_waiver` if the messages are published asynchronously::
+
+        >>> from sqlalchemy.event import listen
+        >>> listen(Waiver, 'after_insert', add_outbox_message)
+
+    Messages in the outbox are published with :func:`dispatch_outbox_messages`.
+    """
+    connection.execute(OutboxMessage.__table__.insert().values(
+        topic=NEW_WAIVER_TOPIC,
+        body=json.dumps(serialize_waiver(target)),
+        created=datetime.datetime.utcnow(),
+        attempts=0,
+    ))
+
+
+def dispatch_outbox_messages(batch_size=100):
+    """
+    Publishes a batch of the oldest messages from the outbox and removes them
+    from the outbox.
+
+    If publishing fails, the messages are kept in the outbox (with increased
+    number of attempts) and the exception is re-raised. Messages published
+    before the failure in the same batch will be published again, so
+    consumers can receive a message more than once.
+
+    Concurrent dispatchers on PostgreSQL do not pick the same messages.
+
+    Returns:
+        int: Number of published messages.
+    """
+    query = OutboxMessage.query.order_by(OutboxMessage.id).limit(batch_size)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        query = query.with_for_update(skip_locked=True)
+    messages = query.all()
+    if not messages:
+        db.session.rollback()
+        return 0
+
+    monitor.messaging_tx_to_send_counter.inc(len(messages))
+    bodies = [json.loads(message.body) for message in messages]
+    publisher = current_app.config['MESSAGE_PUBLISHER']
+    try:
+        if publisher == 'stomp':
+            _send_stomp_messages(bodies)
+        elif publisher == 'fedmsg':
+            _send_fedmsg_messages(bodies)
+        elif publisher is None:
+            _log.info('No message published.  MESSAGE_PUBLISHER disabled.')
+            monitor.messaging_tx_stopped_counter.inc(len(messages))
+        else:
+            raise RuntimeError('Unhandled MESSAGE_PUBLISHER %r' % publisher)
+    except Exception:
+        for message in messages:
+            message.attempts += 1
+        db.session.commit()
+        raise
+
+    for message in messages:
+        db.session.delete(message)
+    db.session.commit()
+    return len(messages)
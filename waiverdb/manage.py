@@ -1,11 +1,15 @@
 # SPDX-License-Identifier: GPL-2.0+
 
+import logging
 import time
 import click
 from flask.cli import FlaskGroup
 from sqlalchemy.exc import OperationalError
+from waiverdb.events import dispatch_outbox_messages
 from waiverdb.models import db
 
+log = logging.getLogger(__name__)
+
 
 def create_waiver_app():
     from waiverdb.app import create_app  # noqa: F401
@@ -35,5 +39,31 @@ def wait_for_db():
             break
 
 
+@cli.command(name='dispatch-messages')
+@click.option('--batch-size', default=100, show_default=True,
+              help='Maximum number of messages to publish at once.')
+@click.option('--poll-interval', default=5, show_default=True,
+              help='Seconds to wait when the outbox is empty or publishing failed.')
+@click.option('--once', is_flag=True,
+              help='Exit when the outbox is empty.')
+def dispatch_messages(batch_size, poll_interval, once):
+    """
+    Publish messages stored in the outbox (see MESSAGE_OUTBOX option).
+    """
+    while True:
+        try:
+            sent = dispatch_outbox_messages(batch_size)
+        except Exception:
+            log.exception('Failed to publish messages from the outbox')
+            db.session.rollback()
+            sent = 0
+            if once:
+                raise
+        if sent == 0:
+            if once:
+                break
+            time.sleep(poll_interval)
+
+
 if __name__ == '__main__':
     cli()  # pylint: disable=E1120
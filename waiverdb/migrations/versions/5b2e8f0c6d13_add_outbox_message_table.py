@@ -0,0 +1,30 @@
+"""Add outbox_message table
+
+Revision ID: 5b2e8f0c6d13
+Revises: 9d5c1b7e4a20
+Create Date: 2026-10-18 11:40:07.283512
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8f0c6d13'
+down_revision = '9d5c1b7e4a20'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        'outbox_message',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('topic', sa.String(length=255), nullable=False),
+        sa.Column('body', sa.Text(), nullable=False),
+        sa.Column('created', sa.DateTime(), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade():
+    op.drop_table('outbox_message')
@@ -0,0 +1,101 @@
+"""Add latest_waiver table
+
+Revision ID: 9d5c1b7e4a20
+Revises: 3868a8118458
+Create Date: 2026-10-18 09:12:31.410215
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9d5c1b7e4a20'
+down_revision = '3868a8118458'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Keep in sync with waiverdb.models.waivers.LATEST_WAIVER_TRIGGER_DDL.
+TRIGGER_DDL = {
+    'postgresql': [
+        """
+        CREATE FUNCTION update_latest_waiver() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO latest_waiver (subject_type, subject_identifier, testcase,
+                                       username, product_version, waiver_id)
+            VALUES (NEW.subject_type, NEW.subject_identifier, NEW.testcase,
+                    NEW.username, NEW.product_version, NEW.id)
+            ON CONFLICT (subject_type, subject_identifier, testcase, username, product_version)
+            DO UPDATE SET waiver_id = greatest(latest_waiver.waiver_id, EXCLUDED.waiver_id);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER waiver_update_latest_waiver AFTER INSERT ON waiver
+        FOR EACH ROW EXECUTE PROCEDURE update_latest_waiver()
+        """,
+    ],
+    'sqlite': [
+        """
+        CREATE TRIGGER waiver_update_latest_waiver AFTER INSERT ON waiver
+        BEGIN
+            INSERT INTO latest_waiver (subject_type, subject_identifier, testcase,
+                                       username, product_version, waiver_id)
+            VALUES (NEW.subject_type, NEW.subject_identifier, NEW.testcase,
+                    NEW.username, NEW.product_version, NEW.id)
+            ON CONFLICT (subject_type, subject_identifier, testcase, username, product_version)
+            DO UPDATE SET waiver_id = max(waiver_id, excluded.waiver_id);
+        END
+        """,
+    ],
+}
+DROP_TRIGGER_DDL = {
+    'postgresql': [
+        'DROP TRIGGER IF EXISTS waiver_update_latest_waiver ON waiver',
+        'DROP FUNCTION IF EXISTS update_latest_waiver()',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS waiver_update_latest_waiver',
+    ],
+}
+
+
+def _dialect_statements(ddl):
+    dialect = op.get_bind().dialect.name
+    if dialect not in ddl:
+        raise RuntimeError('Unsupported database dialect: %s' % dialect)
+    return ddl[dialect]
+
+
+def upgrade():
+    op.create_table(
+        'latest_waiver',
+        sa.Column('subject_type', sa.Text(), nullable=False),
+        sa.Column('subject_identifier', sa.Text(), nullable=False),
+        sa.Column('testcase', sa.Text(), nullable=False),
+        sa.Column('username', sa.String(length=255), nullable=False),
+        sa.Column('product_version', sa.String(length=200), nullable=False),
+        sa.Column('waiver_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['waiver_id'], ['waiver.id']),
+        sa.PrimaryKeyConstraint(
+            'subject_type', 'subject_identifier', 'testcase', 'username', 'product_version'),
+        sa.UniqueConstraint('waiver_id'),
+    )
+    # The trigger is created before the backfill in the same transaction.
+    # Creating it locks the waiver table against concurrent inserts until
+    # commit, so waivers inserted by older versions of the application while
+    # upgrading are either included in the backfill or handled by the trigger.
+    for statement in _dialect_statements(TRIGGER_DDL):
+        op.execute(statement)
+    op.execute("""
+        INSERT INTO latest_waiver
+            (subject_type, subject_identifier, testcase, username, product_version, waiver_id)
+        SELECT subject_type, subject_identifier, testcase, username, product_version, max(id)
+        FROM waiver
+        GROUP BY subject_type, subject_identifier, testcase, username, product_version
+    """)
+
+
+def downgrade():
+    for statement in _dialect_statements(DROP_TRIGGER_DDL):
+        op.execute(statement)
+    op.drop_table('latest_waiver')
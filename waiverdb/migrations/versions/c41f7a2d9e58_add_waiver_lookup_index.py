@@ -0,0 +1,49 @@
+"""Add composite index for waiver lookups
+
+Revision ID: c41f7a2d9e58
+Revises: 5b2e8f0c6d13
+Create Date: 2026-10-18 14:05:52.817340
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c41f7a2d9e58'
+down_revision = '5b2e8f0c6d13'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block,
+    # but it does not lock out writes to the table while the index is built.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_waiver_subject_testcase_product_version',
+            'waiver',
+            [
+                'subject_type',
+                'subject_identifier',
+                'testcase',
+                'product_version',
+                sa.text('timestamp DESC'),
+                sa.text('id DESC'),
+            ],
+            postgresql_concurrently=True,
+        )
+        # Both are prefixes of the new index.
+        op.drop_index('ix_waiver_subject_type_identifier', table_name='waiver',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_waiver_subject_type', table_name='waiver',
+                      postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.create_index('ix_waiver_subject_type', 'waiver', ['subject_type'],
+                        postgresql_concurrently=True)
+        op.create_index('ix_waiver_subject_type_identifier', 'waiver',
+                        ['subject_type', 'subject_identifier'],
+                        postgresql_concurrently=True)
+        op.drop_index('ix_waiver_subject_testcase_product_version', table_name='waiver',
+                      postgresql_concurrently=True)
@@ -0,0 +1,45 @@
+"""Add index on waiver timestamp
+
+Revision ID: e7a94b3f1c02
+Revises: c41f7a2d9e58
+Create Date: 2026-10-18 15:21:09.604177
+
+By default, a B-tree index on (timestamp, id) is created. It is used both for
+ordering and for "since" range filters.
+
+For very large tables, a much smaller BRIN index can be created instead (it
+only helps with range filters and relies on waivers being inserted in
+timestamp order)::
+
+    waiverdb db upgrade -x timestamp_index=brin
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e7a94b3f1c02'
+down_revision = 'c41f7a2d9e58'
+
+from alembic import context, op
+
+
+def _use_brin():
+    method = context.get_x_argument(as_dictionary=True).get('timestamp_index', 'btree')
+    if method not in ('btree', 'brin'):
+        raise ValueError('Unsupported timestamp_index %r, use "btree" or "brin"' % method)
+    return method == 'brin' and op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        if _use_brin():
+            op.create_index('ix_waiver_timestamp_brin', 'waiver', ['timestamp'],
+                            postgresql_using='brin', postgresql_concurrently=True)
+        else:
+            op.create_index('ix_waiver_timestamp_id', 'waiver', ['timestamp', 'id'],
+                            postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX IF EXISTS ix_waiver_timestamp_brin')
+        op.execute('DROP INDEX IF EXISTS ix_waiver_timestamp_id')
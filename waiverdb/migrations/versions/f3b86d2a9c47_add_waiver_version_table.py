@@ -0,0 +1,74 @@
+"""Add waiver_version table
+
+Revision ID: f3b86d2a9c47
+Revises: e7a94b3f1c02
+Create Date: 2026-10-18 18:02:47.118320
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f3b86d2a9c47'
+down_revision = 'e7a94b3f1c02'
+
+from alembic import op
+import sqlalchemy as sa
+
+# Keep in sync with waiverdb.models.waivers.WAIVER_VERSION_TRIGGER_DDL.
+TRIGGER_DDL = {
+    'postgresql': [
+        """
+        CREATE FUNCTION bump_waiver_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE waiver_version SET version = version + 1 WHERE id = 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER waiver_bump_waiver_version AFTER INSERT ON waiver
+        FOR EACH STATEMENT EXECUTE PROCEDURE bump_waiver_version()
+        """,
+    ],
+    'sqlite': [
+        """
+        CREATE TRIGGER waiver_bump_waiver_version AFTER INSERT ON waiver
+        BEGIN
+            UPDATE waiver_version SET version = version + 1 WHERE id = 1;
+        END
+        """,
+    ],
+}
+DROP_TRIGGER_DDL = {
+    'postgresql': [
+        'DROP TRIGGER IF EXISTS waiver_bump_waiver_version ON waiver',
+        'DROP FUNCTION IF EXISTS bump_waiver_version()',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS waiver_bump_waiver_version',
+    ],
+}
+
+
+def _dialect_statements(ddl):
+    dialect = op.get_bind().dialect.name
+    if dialect not in ddl:
+        raise RuntimeError('Unsupported database dialect: %s' % dialect)
+    return ddl[dialect]
+
+
+def upgrade():
+    op.create_table(
+        'waiver_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.execute('INSERT INTO waiver_version (id, version) VALUES (1, 0)')
+    for statement in _dialect_statements(TRIGGER_DDL):
+        op.execute(statement)
+
+
+def downgrade():
+    for statement in _dialect_statements(DROP_TRIGGER_DDL):
+        op.execute(statement)
+    op.drop_table('waiver_version')
@@ -1,4 +1,5 @@
 # SPDX-License-Identifier: GPL-2.0+
 
 from .base import db  # noqa: F401
-from .waivers import Waiver  # noqa: F401
+from .outbox import OutboxMessage  # noqa: F401
+from .waivers import Waiver, LatestWaiver, WaiverVersion  # noqa: F401
@@ -6,7 +6,9 @@ from sqlalchemy.dialects.postgresql.psycopg2 import _PGJSON
 from sqlalchemy.sql.elements import ColumnElement, Null
 from sqlalchemy.sql.expression import cast
 from sqlalchemy.sql.sqltypes import Text
+from flask import g, has_app_context
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 
 
 json_serializer = json.encoder.JSONEncoder(sort_keys=True, separators=(',', ':')).encode
@@ -51,4 +53,20 @@ class EqualityComparableJSONType(_PGJSON):
         return process
 
 
-db = SQLAlchemy()
+class RoutingSession(Session):
+    """
+    Session which sends queries to the read replica selected for the current
+    request (see :mod:`waiverdb.replicas`), if any.
+
+    Flushes always go to the primary database.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context():
+            bind_key = g.get('db_replica')
+            if bind_key is not None:
+                return self._db.engines[bind_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
@@ -0,0 +1,24 @@
+# SPDX-License-Identifier: GPL-2.0+
+
+import datetime
+from .base import db
+
+
+class OutboxMessage(db.Model):
+    """
+    A message waiting to be published to the message bus.
+
+    Messages are written in the same transaction as the data they describe
+    and published later by ``waiverdb dispatch-messages``, so that publishing
+    does not block requests and no message is lost if the broker is down.
+    """
+    __tablename__ = 'outbox_message'
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return '%s(id=%r, topic=%r, attempts=%r)' % (
+            self.__class__.__name__, self.id, self.topic, self.attempts)
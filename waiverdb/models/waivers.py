@@ -2,7 +2,7 @@
 
 import datetime
 from .base import db
-from sqlalchemy import or_, and_, false
+from sqlalchemy import DDL, event, or_, and_, false, tuple_
 
 
 def subject_dict_to_type_identifier(subject):
@@ -43,7 +43,7 @@ def subject_type_identifier_to_dict(subject_type, subject_identifier):
 
 class Waiver(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    subject_type = db.Column(db.Text, nullable=False, index=True)
+    subject_type = db.Column(db.Text, nullable=False)
     subject_identifier = db.Column(db.Text, nullable=False, index=True)
     testcase = db.Column(db.Text, nullable=False, index=True)
     username = db.Column(db.String(255), nullable=False)
@@ -54,7 +54,15 @@ class Waiver(db.Model):
     comment = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     __table_args__ = (
-        db.Index('ix_waiver_subject_type_identifier', subject_type, subject_identifier),
+        # Covers the common lookups by subject, test case and product version,
+        # ordered from the most recent waiver.
+        db.Index('ix_waiver_subject_testcase_product_version',
+                 subject_type, subject_identifier, testcase, product_version,
+                 timestamp.desc(), id.desc()),
+        # Used for listing waivers from the most recent one and for "since"
+        # range filters. The migration can create a BRIN index on timestamp
+        # instead (see "Database Indexes" in the admin guide).
+        db.Index('ix_waiver_timestamp_id', timestamp, id),
     )
 
     def __init__(self, subject_type, subject_identifier, testcase, username, product_version,
@@ -90,6 +98,24 @@ class Waiver(db.Model):
         Returns:
             Filtered query.
         """
+        keys = []
+        for result in results:
+            subject = result.get('subject', None)
+            testcase = result.get('testcase', None)
+            if not subject or not testcase:
+                break
+            try:
+                subject_type, subject_identifier = subject_dict_to_type_identifier(subject)
+            except ValueError:
+                break
+            keys.append((subject_type, subject_identifier, testcase))
+        else:
+            # All filters have the same shape, so match them in a single
+            # IN clause rather than a long chain of ORs.
+            if keys:
+                columns = tuple_(cls.subject_type, cls.subject_identifier, cls.testcase)
+                return query.filter(columns.in_(keys))
+
         clauses = []
         for result in results:
             subject = result.get('subject', None)
@@ -110,3 +136,153 @@ class Waiver(db.Model):
             clauses.append(and_(*inner_clauses))
 
         return query.filter(or_(*clauses))
+
+
+class LatestWaiver(db.Model):
+    """
+    Points to the most recent waiver for each combination of subject, test
+    case, username and product version.
+
+    This is maintained by a database trigger on every insert into the
+    ``waiver`` table so that queries which exclude obsolete waivers do not
+    have to aggregate over the whole waiver history.
+    """
+    __tablename__ = 'latest_waiver'
+    subject_type = db.Column(db.Text, primary_key=True)
+    subject_identifier = db.Column(db.Text, primary_key=True)
+    testcase = db.Column(db.Text, primary_key=True)
+    username = db.Column(db.String(255), primary_key=True)
+    product_version = db.Column(db.String(200), primary_key=True)
+    waiver_id = db.Column(db.Integer, db.ForeignKey('waiver.id'), nullable=False, unique=True)
+
+    def __repr__(self):
+        return ('%s(subject_type=%r, subject_identifier=%r, testcase=%r, username=%r, '
+                'product_version=%r, waiver_id=%r)'
+                % (self.__class__.__name__, self.subject_type, self.subject_identifier,
+                   self.testcase, self.username, self.product_version, self.waiver_id))
+
+
+# The latest_waiver table is maintained by a trigger, so that it is updated
+# for waivers inserted in any way (not only through the ORM). The same trigger
+# is created by the 9d5c1b7e4a20 migration.
+LATEST_WAIVER_TRIGGER_DDL = {
+    'postgresql': [
+        """
+        CREATE FUNCTION update_latest_waiver() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO latest_waiver (subject_type, subject_identifier, testcase,
+                                       username, product_version, waiver_id)
+            VALUES (NEW.subject_type, NEW.subject_identifier, NEW.testcase,
+                    NEW.username, NEW.product_version, NEW.id)
+            ON CONFLICT (subject_type, subject_identifier, testcase, username, product_version)
+            DO UPDATE SET waiver_id = greatest(latest_waiver.waiver_id, EXCLUDED.waiver_id);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER waiver_update_latest_waiver AFTER INSERT ON waiver
+        FOR EACH ROW EXECUTE PROCEDURE update_latest_waiver()
+        """,
+    ],
+    'sqlite': [
+        # SQLite's multi-argument max() is a scalar function like greatest()
+        """
+        CREATE TRIGGER waiver_update_latest_waiver AFTER INSERT ON waiver
+        BEGIN
+            INSERT INTO latest_waiver (subject_type, subject_identifier, testcase,
+                                       username, product_version, waiver_id)
+            VALUES (NEW.subject_type, NEW.subject_identifier, NEW.testcase,
+                    NEW.username, NEW.product_version, NEW.id)
+            ON CONFLICT (subject_type, subject_identifier, testcase, username, product_version)
+            DO UPDATE SET waiver_id = max(waiver_id, excluded.waiver_id);
+        END
+        """,
+    ],
+}
+LATEST_WAIVER_TRIGGER_DROP_DDL = {
+    'postgresql': [
+        'DROP TRIGGER IF EXISTS waiver_update_latest_waiver ON waiver',
+        'DROP FUNCTION IF EXISTS update_latest_waiver()',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS waiver_update_latest_waiver',
+    ],
+}
+
+for dialect, statements in LATEST_WAIVER_TRIGGER_DDL.items():
+    for statement in statements:
+        event.listen(LatestWaiver.__table__, 'after_create',
+                     DDL(statement).execute_if(dialect=dialect))
+for dialect, statements in LATEST_WAIVER_TRIGGER_DROP_DDL.items():
+    for statement in statements:
+        event.listen(LatestWaiver.__table__, 'before_drop',
+                     DDL(statement).execute_if(dialect=dialect))
+
+
+class WaiverVersion(db.Model):
+    """
+    Single row with a counter which is incremented by a database trigger on
+    every insert into the ``waiver`` table, in the same transaction.
+
+    The counter changes with every commit which adds waivers, so it can be
+    used as a cheap watermark for the set of committed waivers (unlike the
+    highest waiver id, because ids are assigned before commit).
+    """
+    __tablename__ = 'waiver_version'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return '%s(version=%r)' % (self.__class__.__name__, self.version)
+
+
+# The trigger references the waiver table.
+WaiverVersion.__table__.add_is_dependent_on(Waiver.__table__)
+
+# The same row and trigger are created by the f3b86d2a9c47 migration. On
+# PostgreSQL, the counter is incremented once per statement.
+WAIVER_VERSION_TRIGGER_DDL = {
+    'postgresql': [
+        """
+        CREATE FUNCTION bump_waiver_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE waiver_version SET version = version + 1 WHERE id = 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE TRIGGER waiver_bump_waiver_version AFTER INSERT ON waiver
+        FOR EACH STATEMENT EXECUTE PROCEDURE bump_waiver_version()
+        """,
+    ],
+    'sqlite': [
+        """
+        CREATE TRIGGER waiver_bump_waiver_version AFTER INSERT ON waiver
+        BEGIN
+            UPDATE waiver_version SET version = version + 1 WHERE id = 1;
+        END
+        """,
+    ],
+}
+WAIVER_VERSION_TRIGGER_DROP_DDL = {
+    'postgresql': [
+        'DROP TRIGGER IF EXISTS waiver_bump_waiver_version ON waiver',
+        'DROP FUNCTION IF EXISTS bump_waiver_version()',
+    ],
+    'sqlite': [
+        'DROP TRIGGER IF EXISTS waiver_bump_waiver_version',
+    ],
+}
+
+event.listen(WaiverVersion.__table__, 'after_create',
+             DDL('INSERT INTO waiver_version (id, version) VALUES (1, 0)'))
+for dialect, statements in WAIVER_VERSION_TRIGGER_DDL.items():
+    for statement in statements:
+        event.listen(WaiverVersion.__table__, 'after_create',
+                     DDL(statement).execute_if(dialect=dialect))
+for dialect, statements in WAIVER_VERSION_TRIGGER_DROP_DDL.items():
+    for statement in statements:
+        event.listen(WaiverVersion.__table__, 'before_drop',
+                     DDL(statement).execute_if(dialect=dialect))
@@ -7,13 +7,15 @@
 
 import os
 import tempfile
+import time
 
-from flask import Response
+from flask import Response, g, request
 from flask.views import MethodView
 from prometheus_client import (  # noqa: F401
-    ProcessCollector, CollectorRegistry, Counter, multiprocess,
+    ProcessCollector, CollectorRegistry, Counter, Gauge, multiprocess,
     Histogram, generate_latest, start_http_server, CONTENT_TYPE_LATEST)
 from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
 
 # Service-specific imports
 
@@ -45,6 +47,14 @@ messaging_tx_failed_counter = Counter(
     'messaging_tx_failed',
     'Number of messages, for which the sender failed',
     registry=registry)
+stomp_connect_counter = Counter(
+    'stomp_connect',
+    'Number of connections established to the STOMP broker',
+    registry=registry)
+stomp_reconnect_counter = Counter(
+    'stomp_reconnect',
+    'Number of connections re-established to the STOMP broker after a failure',
+    registry=registry)
 
 db_dbapi_error_counter = Counter(
     'db_dbapi_error',
@@ -62,9 +72,120 @@ db_transaction_rollback_counter = Counter(
     'db_transaction_rollback',
     'Number of transactions, which were rolled back',
     registry=registry)
+db_pool_checked_out_gauge = Gauge(
+    'db_pool_checked_out',
+    'Number of database connections currently checked out from the pool',
+    multiprocess_mode='livesum',
+    registry=registry)
+db_pool_checkout_wait_histogram = Histogram(
+    'db_pool_checkout_wait_seconds',
+    'Time spent waiting for a database connection from the pool',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0),
+    registry=registry)
+db_connection_lifetime_histogram = Histogram(
+    'db_connection_lifetime_seconds',
+    'Time between opening and closing a database connection',
+    buckets=(1.0, 10.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0, 14400.0, 86400.0),
+    registry=registry)
 
 # Service-specific metrics
-# XXX: TODO
+http_conditional_get_counter = Counter(
+    'http_conditional_get',
+    'Number of responses to GET requests supporting validators, by status code',
+    ['status'],
+    registry=registry)
+
+replica_failover_counter = Counter(
+    'replica_failover',
+    'Number of read requests retried on the primary database after a replica failed',
+    registry=registry)
+
+filtered_waivers_cache_counter = Counter(
+    'filtered_waivers_cache',
+    'Number of POST /waivers/+filtered cache lookups, by result (hit, miss or error)',
+    ['result'],
+    registry=registry)
+
+http_request_duration_histogram = Histogram(
+    'http_request_duration_seconds',
+    'Time spent handling API requests, by endpoint, method and status code',
+    ['endpoint', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+    registry=registry)
+http_requests_in_progress_gauge = Gauge(
+    'http_requests_in_progress',
+    'Number of API requests being handled, by endpoint and method',
+    ['endpoint', 'method'],
+    multiprocess_mode='livesum',
+    registry=registry)
+http_response_size_histogram = Histogram(
+    'http_response_size_bytes',
+    'Size of API response bodies (except streamed responses), by endpoint and method',
+    ['endpoint', 'method'],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+    registry=registry)
+
+oidc_token_cache_counter = Counter(
+    'oidc_token_cache',
+    'Number of OIDC access token validation cache lookups, by result (hit, miss or error)',
+    ['result'],
+    registry=registry)
+
+ldap_membership_cache_counter = Counter(
+    'ldap_membership_cache',
+    'Number of LDAP group membership cache lookups, by result (hit, miss or error)',
+    ['result'],
+    registry=registry)
+ldap_connect_counter = Counter(
+    'ldap_connect',
+    'Number of new connections opened to the LDAP server',
+    registry=registry)
+ldap_circuit_open_counter = Counter(
+    'ldap_circuit_open',
+    'Number of LDAP requests rejected because the LDAP server was recently unreachable',
+    registry=registry)
+ldap_search_duration_histogram = Histogram(
+    'ldap_search_duration_seconds',
+    'Time spent searching LDAP for group membership',
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+    registry=registry)
+
+
+def _request_labels():
+    return str(request.endpoint), request.method
+
+
+def before_request():
+    g.monitor_request_start = time.monotonic()
+    http_requests_in_progress_gauge.labels(*_request_labels()).inc()
+
+
+def after_request(response):
+    start = g.get('monitor_request_start')
+    if start is not None:
+        endpoint, method = _request_labels()
+        http_request_duration_histogram.labels(endpoint, method, response.status_code).observe(
+            time.monotonic() - start)
+        if not response.is_streamed:
+            http_response_size_histogram.labels(endpoint, method).observe(
+                response.calculate_content_length() or 0)
+    return response
+
+
+def teardown_request(exception=None):
+    # Unlike after_request, this is called even after unhandled exceptions.
+    if g.pop('monitor_request_start', None) is not None:
+        http_requests_in_progress_gauge.labels(*_request_labels()).dec()
+
+
+def register_request_metrics(blueprint):
+    """
+    Registers request hooks measuring latency, response size and number of
+    requests in progress for all views in the blueprint.
+    """
+    blueprint.before_request(before_request)
+    blueprint.after_request(after_request)
+    blueprint.teardown_request(teardown_request)
 
 
 def db_hook_event_listeners(target=None):
@@ -86,6 +207,45 @@ def db_hook_event_listeners(target=None):
     def receive_rollback(conn):
         db_transaction_rollback_counter.inc()
 
+    @event.listens_for(target, 'connect')
+    def receive_connect(dbapi_connection, connection_record):
+        connection_record.info['monitor_connected'] = time.monotonic()
+
+    @event.listens_for(target, 'close')
+    def receive_close(dbapi_connection, connection_record):
+        connected = connection_record.info.pop('monitor_connected', None)
+        if connected is not None:
+            db_connection_lifetime_histogram.observe(time.monotonic() - connected)
+
+    @event.listens_for(target, 'checkout')
+    def receive_checkout(dbapi_connection, connection_record, connection_proxy):
+        db_pool_checked_out_gauge.inc()
+
+    @event.listens_for(target, 'checkin')
+    def receive_checkin(dbapi_connection, connection_record):
+        db_pool_checked_out_gauge.dec()
+
+
+class CheckoutTimingMixin(object):
+    """
+    Pool mixin which measures how long it takes to get a connection from the
+    pool (including opening a new connection, if needed).
+    """
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_wait_histogram.observe(time.monotonic() - start)
+
+
+class InstrumentedQueuePool(CheckoutTimingMixin, QueuePool):
+    pass
+
+
+class InstrumentedNullPool(CheckoutTimingMixin, NullPool):
+    pass
+
 
 class MonitorAPI(MethodView):
     def get(self):
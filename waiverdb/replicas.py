@@ -0,0 +1,138 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Routing of read-only requests to database replicas.
+
+Replicas from REPLICA_DATABASE_URIS option are configured as additional
+Flask-SQLAlchemy binds. Views decorated with :func:`use_replica` pick one of
+them in round-robin order and :class:`waiverdb.models.base.RoutingSession`
+sends their queries there.
+
+Replicas can lag behind the primary database, so clients which have just
+created waivers are pinned to the primary database for a while (see
+:func:`pin_to_primary`).
+"""
+
+import functools
+import logging
+import threading
+import time
+
+from flask import after_this_request, current_app, g, request
+from sqlalchemy.exc import OperationalError
+
+import waiverdb.monitor as monitor
+from waiverdb.models import db
+
+log = logging.getLogger(__name__)
+
+REPLICA_BIND_KEY_PREFIX = 'replica_'
+PRIMARY_PIN_COOKIE = 'waiverdb_primary_until'
+
+
+def replica_binds(uris):
+    """
+    Returns SQLALCHEMY_BINDS entries for the replica database URIs.
+    """
+    return {
+        '%s%d' % (REPLICA_BIND_KEY_PREFIX, i): uri
+        for i, uri in enumerate(uris)
+    }
+
+
+class ReplicaSelector(object):
+    """
+    Picks replica bind keys in round-robin order, skipping replicas which
+    recently failed for ``retry_delay`` seconds.
+    """
+    def __init__(self, bind_keys, retry_delay=30):
+        self.bind_keys = list(bind_keys)
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._next = 0
+        self._failed_until = {}
+
+    def choose(self):
+        """
+        Returns a bind key of a healthy replica or None if there is none.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for _ in range(len(self.bind_keys)):
+                bind_key = self.bind_keys[self._next]
+                self._next = (self._next + 1) % len(self.bind_keys)
+                if self._failed_until.get(bind_key, 0) <= now:
+                    return bind_key
+        return None
+
+    def mark_failed(self, bind_key):
+        with self._lock:
+            self._failed_until[bind_key] = time.monotonic() + self.retry_delay
+
+
+def create_replica_selector(config):
+    """
+    Returns :class:`ReplicaSelector` for REPLICA_DATABASE_URIS option or None
+    if no replicas are configured.
+    """
+    uris = config.get('REPLICA_DATABASE_URIS')
+    if not uris:
+        return None
+    return ReplicaSelector(replica_binds(uris), config['REPLICA_RETRY_DELAY'])
+
+
+def _is_pinned_to_primary():
+    try:
+        return float(request.cookies.get(PRIMARY_PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def pin_to_primary():
+    """
+    Makes following read requests from the same client (sent with the
+    returned cookie) use the primary database for REPLICA_READ_YOUR_WRITES
+    seconds, so the client can read its own writes even if replicas lag
+    behind.
+    """
+    if getattr(current_app, 'replica_selector', None) is None:
+        return
+
+    seconds = current_app.config['REPLICA_READ_YOUR_WRITES']
+
+    @after_this_request
+    def set_cookie(response):
+        response.set_cookie(
+            PRIMARY_PIN_COOKIE, str(time.time() + seconds), max_age=seconds, httponly=True)
+        return response
+
+
+def use_replica(view):
+    """
+    Decorator for read-only views which sends their database queries to
+    a replica, if any is configured and healthy.
+
+    If the replica fails, it is skipped for REPLICA_RETRY_DELAY seconds and
+    the view is called again using the primary database.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        selector = getattr(current_app, 'replica_selector', None)
+        if selector is None or _is_pinned_to_primary():
+            return view(*args, **kwargs)
+
+        bind_key = selector.choose()
+        if bind_key is None:
+            return view(*args, **kwargs)
+
+        g.db_replica = bind_key
+        try:
+            return view(*args, **kwargs)
+        except OperationalError:
+            log.exception('Query failed on database replica %s, using primary', bind_key)
+            monitor.replica_failover_counter.inc()
+            selector.mark_failed(bind_key)
+            db.session.rollback()
+            g.pop('db_replica', None)
+        return view(*args, **kwargs)
+
+    return wrapper
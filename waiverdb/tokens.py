@@ -0,0 +1,144 @@
+# SPDX-License-Identifier: GPL-2.0+
+"""
+Validation of OIDC access tokens with a cache of validated tokens.
+
+Tokens are validated either by the token introspection endpoint of the
+identity provider (using flask-oidc) or, if ``OIDC_JWKS_URI`` is set, by
+verifying the JWT signature locally with keys fetched from the identity
+provider (and cached for ``OIDC_JWKS_CACHE_TTL`` seconds).
+"""
+
+import hashlib
+import time
+
+from flask import g
+from werkzeug.exceptions import Unauthorized
+
+import waiverdb.monitor as monitor
+from waiverdb.cache import LocalCache
+
+INVALID_TOKEN_ERROR = 'Token required but invalid'
+MISSING_SCOPES_ERROR = 'Token does not have required scopes'
+
+
+def _token_scopes(token_info):
+    scopes = token_info.get('scope', '')
+    if isinstance(scopes, str):
+        scopes = scopes.split(' ')
+    return set(scopes)
+
+
+class TokenValidator(object):
+    """
+    Validates OIDC access tokens and returns token information (introspection
+    response or JWT claims), raising Unauthorized for invalid tokens.
+
+    If ``cache`` (:class:`waiverdb.cache.LocalCache`) is set, token
+    information for valid tokens is cached by SHA-256 hash of the token, for
+    at most the cache TTL and never after the token expires (``exp`` claim).
+    Required scopes are checked even for cached tokens.
+    """
+    def __init__(self, oidc, cache=None, jwks_uri=None, jwks_cache_ttl=300,
+                 algorithms=('RS256',), audience=None, issuer=None,
+                 username_field='username'):
+        self.oidc = oidc
+        self.cache = cache
+        self.algorithms = list(algorithms)
+        self.audience = audience
+        self.issuer = issuer
+        self.username_field = username_field
+        self._jwks_client = None
+        if jwks_uri:
+            import jwt
+            self._jwks_client = jwt.PyJWKClient(
+                jwks_uri, cache_keys=True, lifespan=jwks_cache_ttl)
+
+    def validate(self, token, required_scopes):
+        cache_key = None
+        token_info = None
+        if self.cache is not None:
+            cache_key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+            token_info = self.cache.get(cache_key)
+            # The entry TTL is monotonic time, but "exp" is wall-clock time.
+            if token_info is not None and token_info.get('exp', float('inf')) <= time.time():
+                token_info = None
+            result = 'miss' if token_info is None else 'hit'
+            monitor.oidc_token_cache_counter.labels(result=result).inc()
+
+        if token_info is None:
+            if self._jwks_client is not None:
+                token_info = self._decode_jwt(token)
+            else:
+                token_info = self._introspect(token, required_scopes)
+            if cache_key is not None:
+                self._cache_token_info(cache_key, token_info)
+
+        if not set(required_scopes).issubset(_token_scopes(token_info)):
+            raise Unauthorized(MISSING_SCOPES_ERROR)
+
+        return token_info
+
+    def _introspect(self, token, required_scopes):
+        validity = self.oidc.validate_token(token, required_scopes)
+        if validity is not True:
+            raise Unauthorized(validity)
+        return g.oidc_token_info
+
+    def _decode_jwt(self, token):
+        import jwt
+        try:
+            signing_key = self._jwks_client.get_signing_key_from_jwt(token)
+            claims = jwt.decode(
+                token,
+                signing_key.key,
+                algorithms=self.algorithms,
+                audience=self.audience,
+                issuer=self.issuer,
+                options={
+                    'require': ['exp'],
+                    'verify_aud': self.audience is not None,
+                },
+            )
+        except jwt.PyJWTError as e:
+            raise Unauthorized(f'{INVALID_TOKEN_ERROR}: {e}')
+
+        claims.setdefault('username', claims.get(self.username_field))
+        return claims
+
+    def _cache_token_info(self, cache_key, token_info):
+        ttl = self.cache.ttl
+        if 'exp' in token_info:
+            ttl = min(ttl, token_info['exp'] - time.time())
+        if ttl > 0:
+            self.cache.set(cache_key, token_info, ttl=ttl)
+
+
+def create_token_validator(config, oidc):
+    """
+    Returns TokenValidator based on OIDC_* options.
+    """
+    cache = None
+    max_size = config['OIDC_TOKEN_CACHE_SIZE']
+    if max_size > 0 and config['OIDC_TOKEN_CACHE_TTL'] > 0:
+        cache = LocalCache(max_size, config['OIDC_TOKEN_CACHE_TTL'])
+
+    jwks_uri = config.get('OIDC_JWKS_URI')
+    if not jwks_uri:
+        return TokenValidator(oidc, cache=cache)
+
+    audience = None
+    if config.get('OIDC_RESOURCE_CHECK_AUD'):
+        audience = oidc.client_secrets['client_id']
+    try:
+        return TokenValidator(
+            oidc,
+            cache=cache,
+            jwks_uri=jwks_uri,
+            jwks_cache_ttl=config['OIDC_JWKS_CACHE_TTL'],
+            algorithms=config['OIDC_JWT_ALGORITHMS'],
+            audience=audience,
+            issuer=config.get('OIDC_JWT_ISSUER'),
+            username_field=config['OIDC_USERNAME_FIELD'],
+        )
+    except ImportError:
+        raise RuntimeError('If OIDC_JWKS_URI is defined, PyJWT needs to be installed.')
@@ -1,43 +1,282 @@
 # SPDX-License-Identifier: GPL-2.0+
 
+import atexit
+import base64
+import binascii
+import copy
+import datetime
 import functools
+import hashlib
+import json
+import logging
+import threading
 import stomp
-from flask import request, url_for, jsonify, current_app
-from flask_restful import marshal
-from waiverdb.fields import waiver_fields
-from werkzeug.exceptions import NotFound, HTTPException
+import waiverdb.monitor as monitor
+from flask import (
+    after_this_request,
+    current_app,
+    jsonify,
+    request,
+    Response,
+    stream_with_context,
+    url_for,
+)
+from sqlalchemy.sql.expression import and_, or_
+from waiverdb.fields import serialize_waiver
+from werkzeug.exceptions import BadRequest, NotFound, HTTPException
 from contextlib import contextmanager
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def json_collection(query, page=1, limit=10):
+log = logging.getLogger(__name__)
+
+
+def json_dumps(data):
+    """
+    Serializes ``data`` to a JSON string, using orjson if it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(data).decode('utf-8')
+    return json.dumps(data)
+
+
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+
+def estimate_count(query):
+    """
+    Returns the number of rows the PostgreSQL planner expects the query to
+    return. This is much cheaper than COUNT(*) for large results but can be
+    far off if the table statistics are outdated.
+
+    Returns None for other databases.
+    """
+    connection = query.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return None
+    compiled = query.order_by(None).statement.compile(
+        dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    plan = connection.exec_driver_sql(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def _page_items(query, page, limit, count):
+    """
+    Returns a tuple (items, has_next, total) for the given page, or None if
+    the page is out of range.
+
+    With count "exact", the total number of rows is counted. Otherwise, one
+    extra row is fetched to find out whether there is a next page and the
+    total is either estimated or None.
+    """
+    if count == 'exact':
+        try:
+            p = query.paginate(page=page, per_page=limit)
+        except NotFound:
+            return None
+        return p.items, p.has_next, p.total
+
+    if page < 1 or limit < 1:
+        return None
+    offset = (page - 1) * limit
+    items = query.offset(offset).limit(limit + 1).all()
+    if not items and page != 1:
+        return None
+    has_next = len(items) > limit
+    items = items[:limit]
+
+    total = None
+    if count == 'estimate':
+        total = estimate_count(query)
+        if total is None:
+            total = query.order_by(None).count()
+        # The estimate must not contradict the rows actually seen.
+        if has_next:
+            total = max(total, offset + limit + 1)
+        else:
+            total = offset + len(items)
+    return items, has_next, total
+
+
+def json_collection(query, page=1, limit=10, fields=None, count='exact'):
     """
     Helper function for Flask request handlers which want to return
     a collection of resources as JSON.
+
+    If ``fields`` is set, only these waiver fields are returned.
+
+    The ``count`` argument sets how the total number of rows, needed for the
+    ``last`` link, is computed: "exact" runs a COUNT query, "estimate" uses
+    the PostgreSQL planner estimate (see :func:`estimate_count`) and "none"
+    skips it and sets ``last`` to null.
     """
-    try:
-        p = query.paginate(page=page, per_page=limit)
-    except NotFound:
+    result = _page_items(query, page, limit, count)
+    if result is None:
         return {'data': [], 'prev': None, 'next': None, 'first': None, 'last': None}
-    pages = {'data': marshal(p.items, waiver_fields)}
+    items, has_next, total = result
+    pages = {'data': [serialize_waiver(waiver, fields) for waiver in items]}
     query_pairs = request.args.copy()
     if query_pairs:
         # remove the page number
         query_pairs.pop('page', default=None)
-    if p.has_prev:
-        pages['prev'] = url_for(request.endpoint, page=p.prev_num, _external=True,
+    # keep repeated parameters
+    query_pairs = query_pairs.to_dict(flat=False)
+    if page > 1:
+        pages['prev'] = url_for(request.endpoint, page=page - 1, _external=True,
                                 **query_pairs)
     else:
         pages['prev'] = None
-    if p.has_next:
-        pages['next'] = url_for(request.endpoint, page=p.next_num, _external=True,
+    if has_next:
+        pages['next'] = url_for(request.endpoint, page=page + 1, _external=True,
                                 **query_pairs)
     else:
         pages['next'] = None
     pages['first'] = url_for(request.endpoint, page=1, _external=True, **query_pairs)
-    pages['last'] = url_for(request.endpoint, page=p.pages, _external=True, **query_pairs)
+    if total is None:
+        pages['last'] = None
+    else:
+        last_page = -(-total // limit)
+        pages['last'] = url_for(request.endpoint, page=last_page, _external=True,
+                                **query_pairs)
     return pages
 
 
+def encode_cursor(timestamp, id_, direction):
+    """
+    Encode position of a row in (timestamp, id) ordering into an opaque
+    cursor string.
+    """
+    data = {'t': timestamp.isoformat(), 'i': id_, 'd': direction}
+    raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Inverse of :func:`encode_cursor`.
+
+    Returns a tuple (timestamp, id, direction).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw.decode('utf-8'))
+        timestamp = datetime.datetime.fromisoformat(data['t'])
+        id_ = int(data['i'])
+        direction = data['d']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise BadRequest({'cursor': 'Invalid cursor value'})
+    if direction not in ('next', 'prev'):
+        raise BadRequest({'cursor': 'Invalid cursor value'})
+    return timestamp, id_, direction
+
+
+def json_cursor_collection(query, timestamp_column, id_column, cursor=None, limit=10,
+                           fields=None):
+    """
+    Helper function for Flask request handlers which want to return
+    a collection of resources as JSON using keyset (cursor) pagination.
+
+    Rows are ordered by (``timestamp_column``, ``id_column``) descending. Unlike
+    :func:`json_collection`, this does not issue any COUNT query and does not
+    use OFFSET, so the cost of fetching a page does not depend on how deep
+    into the collection it is.
+
+    The ``next`` and ``prev`` links contain opaque cursors. There is no
+    ``last`` link since computing it would require counting all rows.
+
+    If ``fields`` is set, only these waiver fields are returned.
+    """
+    query = query.order_by(None)
+    direction = 'next'
+    if cursor:
+        timestamp, id_, direction = decode_cursor(cursor)
+        if direction == 'next':
+            query = query.filter(or_(
+                timestamp_column < timestamp,
+                and_(timestamp_column == timestamp, id_column < id_),
+            ))
+        else:
+            query = query.filter(or_(
+                timestamp_column > timestamp,
+                and_(timestamp_column == timestamp, id_column > id_),
+            ))
+
+    if direction == 'next':
+        query = query.order_by(timestamp_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(timestamp_column.asc(), id_column.asc())
+
+    if limit < 1:
+        # Same as an out of range page in json_collection().
+        return {'data': [], 'prev': None, 'next': None, 'first': None, 'last': None}
+
+    # Fetch one extra row to find out whether there is another page.
+    items = query.limit(limit + 1).all()
+    has_more = len(items) > limit
+    items = items[:limit]
+    if direction == 'prev':
+        items.reverse()
+
+    if direction == 'next':
+        has_next = has_more
+        has_prev = bool(cursor) and bool(items)
+    else:
+        has_next = bool(items)
+        has_prev = has_more
+
+    query_pairs = request.args.copy()
+    query_pairs.pop('cursor', default=None)
+    query_pairs.pop('page', default=None)
+    query_pairs = query_pairs.to_dict(flat=False)
+    pages = {'data': [serialize_waiver(waiver, fields) for waiver in items]}
+    if has_prev:
+        first = items[0]
+        pages['prev'] = url_for(
+            request.endpoint, _external=True,
+            cursor=encode_cursor(first.timestamp, first.id, 'prev'), **query_pairs)
+    else:
+        pages['prev'] = None
+    if has_next:
+        last = items[-1]
+        pages['next'] = url_for(
+            request.endpoint, _external=True,
+            cursor=encode_cursor(last.timestamp, last.id, 'next'), **query_pairs)
+    else:
+        pages['next'] = None
+    pages['first'] = url_for(request.endpoint, _external=True, cursor='', **query_pairs)
+    pages['last'] = None
+    return pages
+
+
+def json_stream_collection(query, batch_size=1000, fields=None):
+    """
+    Helper function for Flask request handlers which want to return a large
+    collection of resources as JSON.
+
+    Rows are fetched in batches of ``batch_size`` (using a server-side cursor
+    where the database supports it) and the response body is encoded and
+    sent incrementally, so neither the full list of objects nor the full
+    response body is held in memory.
+
+    The response has the same shape as a non-paginated collection:
+    ``{"data": [...]}``. If ``fields`` is set, only these waiver fields are
+    returned.
+    """
+    def generate():
+        yield '{"data": ['
+        separator = ''
+        for row in query.yield_per(batch_size):
+            yield separator + json_dumps(serialize_waiver(row, fields))
+            separator = ','
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
 def json_error(error):
     """
     Return error responses in JSON.
@@ -65,7 +304,10 @@ def jsonp(func):
     def wrapped(*args, **kwargs):
         callback = request.args.get('callback', False)
         if callback:
-            resp = jsonify(func(*args, **kwargs))
+            resp = func(*args, **kwargs)
+            if isinstance(resp, Response):
+                return resp
+            resp = jsonify(resp)
             resp.set_data('{}({})'.format(
                 str(callback),
                 resp.get_data()
@@ -77,10 +319,144 @@ def jsonp(func):
     return wrapped
 
 
+def _create_stomp_connection(configs):
+    conn_args = configs['connection'].copy()
+    if 'use_ssl' in conn_args:
+        use_ssl = conn_args['use_ssl']
+        del conn_args['use_ssl']
+    else:
+        use_ssl = False
+
+    ssl_args = {'for_hosts': conn_args['host_and_ports']}
+    for attr in ('key_file', 'cert_file', 'ca_certs'):
+        conn_attr = f'ssl_{attr}'
+        if conn_attr in conn_args:
+            ssl_args[attr] = conn_args[conn_attr]
+            del conn_args[conn_attr]
+
+    conn = stomp.connect.StompConnection11(**conn_args)
+
+    if use_ssl:
+        conn.set_ssl(**ssl_args)
+
+    conn.connect(wait=True, **configs.get('credentials', {}))
+    return conn
+
+
+class StompConnectionManager(object):
+    """
+    Keeps a single STOMP connection open per process and shares it between
+    threads.
+
+    The connection is created on first use and re-created lazily if it is
+    found disconnected, if sending over it fails or if the configuration
+    changes.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._configs = None
+        self._dropped = False
+
+    def _disconnect(self):
+        conn = self._conn
+        self._conn = None
+        self._configs = None
+        try:
+            conn.disconnect()
+        except Exception:
+            log.warning('Failed to disconnect from STOMP broker', exc_info=True)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._disconnect()
+
+    @contextmanager
+    def connection(self, configs):
+        with self._lock:
+            if self._conn is not None and self._configs != configs:
+                self._disconnect()
+            elif self._conn is not None and not self._conn.is_connected():
+                self._disconnect()
+                self._dropped = True
+
+            if self._conn is None:
+                self._conn = _create_stomp_connection(configs)
+                self._configs = copy.deepcopy(configs)
+                monitor.stomp_connect_counter.inc()
+                if self._dropped:
+                    monitor.stomp_reconnect_counter.inc()
+                    self._dropped = False
+
+            try:
+                yield self._conn
+            except Exception:
+                self._disconnect()
+                self._dropped = True
+                raise
+
+
+stomp_connection_manager = StompConnectionManager()
+atexit.register(stomp_connection_manager.close)
+
+
+def make_etag(*parts):
+    """
+    Returns an entity tag computed from the given JSON-serializable values.
+    """
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def conditional_get(etag, last_modified=None):
+    """
+    Helper function for Flask request handlers which support conditional GET
+    requests.
+
+    Returns a "304 Not Modified" response if the validators sent by the client
+    (If-None-Match or, if missing, If-Modified-Since) match ``etag`` or
+    ``last_modified`` (naive UTC datetime). Otherwise returns None and adds
+    the ETag and Last-Modified headers to the response for the request.
+    """
+    if last_modified is not None:
+        last_modified = last_modified.replace(microsecond=0, tzinfo=datetime.timezone.utc)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since:
+        not_modified = last_modified <= request.if_modified_since
+    else:
+        not_modified = False
+
+    if not_modified:
+        monitor.http_conditional_get_counter.labels(status='304').inc()
+        response = Response(status=304)
+        response.set_etag(etag)
+        # Werkzeug sets the current time if None is assigned.
+        if last_modified is not None:
+            response.last_modified = last_modified
+        return response
+
+    @after_this_request
+    def add_validators(response):
+        if response.status_code == 200:
+            monitor.http_conditional_get_counter.labels(status='200').inc()
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+        return response
+
+    return None
+
+
 @contextmanager
 def stomp_connection():
     """
     Helper function for stomp connection.
+
+    The connection is shared by all threads in the process and is kept open
+    after use (see :class:`StompConnectionManager`).
     """
     if current_app.config.get('STOMP_CONFIGS'):
         configs = current_app.config.get('STOMP_CONFIGS')
@@ -91,31 +467,8 @@ def stomp_connection():
             raise RuntimeError('stomp was configured to publish messages,, '
                                'but connection is not configured in STOMP_CONFIGS')
 
-        conn_args = configs['connection'].copy()
-        if 'use_ssl' in conn_args:
-            use_ssl = conn_args['use_ssl']
-            del conn_args['use_ssl']
-        else:
-            use_ssl = False
-
-        ssl_args = {'for_hosts': conn_args['host_and_ports']}
-        for attr in ('key_file', 'cert_file', 'ca_certs'):
-            conn_attr = f'ssl_{attr}'
-            if conn_attr in conn_args:
-                ssl_args[attr] = conn_args[conn_attr]
-                del conn_args[conn_attr]
-
-        conn = stomp.connect.StompConnection11(**conn_args)
-
-        if use_ssl:
-            conn.set_ssl(**ssl_args)
-
-        conn.connect(wait=True, **configs.get('credentials', {}))
-
-        try:
+        with stomp_connection_manager.connection(configs) as conn:
             yield conn
-        finally:
-            conn.disconnect()
     else:
         raise RuntimeError('stomp was configured to publish messages, '
                            'but STOMP_CONFIGS is not configured')